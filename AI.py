@@ -1,75 +1,233 @@
-from azure.ai.inference import ChatCompletionsClient
 from azure.ai.inference.models import SystemMessage, UserMessage
-from azure.core.credentials import AzureKeyCredential
+import hashlib
+import json
+import time
+import llm_pool
+from endpoints import base_url
+import metrics
+from disk_cache import DiskCache
+from prompt_format import encode_frame, encode_frames
 
+ENDPOINT = base_url('inference') + '/'
+REPORT_MODEL = "Cohere-command-r"
+CHAT_MODEL = "gpt-4o-mini"
 
+# Generated reports keyed by a hash of everything that goes into the completion,
+# so the same data, prompt and sampling settings return the stored report instantly
+report_cache = DiskCache('reports', max_bytes=10 * 1024 * 1024)
+REPORT_CACHE_TTL = 60 * 60  # seconds
 
-def get_agricultural_response(auth_token, df1, df2, temperature=0.3, max_tokens=4096, top_p=0.9):
-    # Convert DataFrames to a string format that can be included in the message
-    df1_str = df1.to_string(index=False)
-    df2_str = df2.to_string(index=False)
+# Reports and chat answers are split into sections with this marker
+SECTION_SEPARATOR = '---'
 
-    user_msg = f"Current and historical data:\n{df1_str}\n\nForecasted data:\n{df2_str}"
 
-    # Create the client
-    client = ChatCompletionsClient(
-        endpoint="https://models.inference.ai.azure.com/",
-        credential=AzureKeyCredential(auth_token),
-    )
+# Stable hash of the prompt messages, model and sampling parameters
+def report_cache_key(messages, model, temperature, max_tokens, top_p):
+    payload = json.dumps({
+        'messages': [[type(message).__name__, message.content] for message in messages],
+        'model': model,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'top_p': top_p,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Cache key of the report get_agricultural_response would generate for these frames
+def agricultural_report_key(df1, df2, temperature=0.3, max_tokens=4096, top_p=0.9, climate_df=None):
+    return report_cache_key(_report_messages(df1, df2, climate_df), REPORT_MODEL, temperature, max_tokens, top_p)
+
+
+# Clients are shared process-wide, see llm_pool
+def _create_client(auth_token):
+    return llm_pool.get_client(auth_token, ENDPOINT)
+
+
+# Today's daily figures against the long-term normals from climatology.assess_weather, or ''
+def _climate_context(climate_df):
+    if climate_df is None or climate_df.empty:
+        return ''
+    table = encode_frame(climate_df[['Measure', 'Value', 'Normal', 'Anomaly', 'Percentile']])
+    return f"\n\nToday compared with the 30-year normal for this time of year (Percentile 0-100):\n{table}"
+
+
+def _report_messages(df1, df2, climate_df=None):
+    # Convert DataFrames to compact tables that fit in the prompt token budget
+    df1_str, df2_str = encode_frames(df1, df2)
+
+    user_msg = f"Current and historical data:\n{df1_str}\n\nForecasted data:\n{df2_str}" + _climate_context(climate_df)
 
     # Prepare messages
     system_msg = "You will be provided with two tables containing weather and agriculture data: one with current and historical data, and another with forecasted data. Your task is to analyze this data by comparing current conditions with historical trends and forecasts. Identify patterns, anomalies, and key agricultural impacts such as optimal farming periods, weather-related risks, and crop suitability based on soil and temperature conditions. Generate a concise and insightful report tailored to farmers, offering actionable advice on irrigation, planting, harvesting, and resource management to help improve farm productivity. split the report into four sections each section ending with --- ,write the report with NO main title and make chapters titles header 2"
 
     # Create messages to be sent to the model
-    messages = [
+    return [
         SystemMessage(content=system_msg),
         UserMessage(content=user_msg),
     ]
 
-    # Get the response
-    response = client.complete(
-        messages=messages,
-        model="Cohere-command-r",
-        temperature=temperature,
-        max_tokens=max_tokens,
-        top_p=top_p
-    )
-
-    # Return the content of the response
-    return response.choices[0].message.content
 
-def get_agricultural_chat(auth_token, user_input, location,df1,df2, temperature=0.3, max_tokens=4096, top_p=0.9):
-    # Create the client
-    client = ChatCompletionsClient(
-        endpoint="https://models.inference.ai.azure.com/",
-        credential=AzureKeyCredential(auth_token),
-    )
+def _chat_messages(user_input, location, df1, df2, climate_df=None):
+    df1_str, df2_str = encode_frames(df1, df2)
+    climate_str = _climate_context(climate_df).replace('\n', '\n    ')
 
     # Prepare messages
-    system_msg = f"""You will be provided with a prompt requesting a custom statistic about agriculture, along with the user's location data {location}, and current data collected from this same location {df1} and {df2}
+    system_msg = f"""You will be provided with a prompt requesting a custom statistic about agriculture, along with the user's location data {location}, and current data collected from this same location.
+    Table 1:
+    {df1_str}
+
+    Table 2:
+    {df2_str}{climate_str}
+
     Output the following in Markdown format:
     1. Title
     2. **Statistics Paragraph**: Write a concise paragraph summarizing the statistics provided.
     ---
-    3. Statistics paragraph from {df1}
+    3. Statistics paragraph from Table 1
     ---
-    4. Statistics paragraph from {df2}
+    4. Statistics paragraph from Table 2
     """
 
     # Create messages to be sent to the model
-    messages = [
+    return [
         SystemMessage(content=system_msg),
         UserMessage(content=user_input),
     ]
 
+
+# Pass refresh=True to ignore the cached report and generate a new one
+def get_agricultural_response(auth_token, df1, df2, temperature=0.3, max_tokens=4096, top_p=0.9, refresh=False,
+                              climate_df=None):
+    messages = _report_messages(df1, df2, climate_df)
+    key = report_cache_key(messages, REPORT_MODEL, temperature, max_tokens, top_p)
+    if not refresh:
+        cached = report_cache.get(key, max_age=REPORT_CACHE_TTL)
+        if cached is not None:
+            return cached
+
+    # Get the response
+    client = _create_client(auth_token)
+    with metrics.span('llm', model=REPORT_MODEL, stream=False) as span, llm_pool.completion_slot(REPORT_MODEL):
+        response = client.complete(
+            messages=messages,
+            model=REPORT_MODEL,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p
+        )
+        _record_usage(span, response.usage)
+
+    # Store and return the content of the response
+    content = response.choices[0].message.content
+    report_cache.set(key, content)
+    return content
+
+def get_agricultural_chat(auth_token, user_input, location, df1, df2, temperature=0.3, max_tokens=4096, top_p=0.9,
+                          climate_df=None):
     # Get the response
-    response = client.complete(
-        messages=messages,
-        model="gpt-4o-mini",
-        temperature=temperature,
-        max_tokens=max_tokens,
-        top_p=top_p
-    )
+    client = _create_client(auth_token)
+    with metrics.span('llm', model=CHAT_MODEL, stream=False) as span, llm_pool.completion_slot(CHAT_MODEL):
+        response = client.complete(
+            messages=_chat_messages(user_input, location, df1, df2, climate_df),
+            model=CHAT_MODEL,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p
+        )
+        _record_usage(span, response.usage)
 
     # Return the content of the response
-    return response.choices[0].message.content
\ No newline at end of file
+    return response.choices[0].message.content
+
+
+# Streaming version of get_agricultural_response, yields text deltas as they arrive.
+# A cached report is yielded in one piece, a new one is cached once the stream completes.
+def stream_agricultural_response(auth_token, df1, df2, temperature=0.3, max_tokens=4096, top_p=0.9, refresh=False,
+                                 climate_df=None):
+    messages = _report_messages(df1, df2, climate_df)
+    key = report_cache_key(messages, REPORT_MODEL, temperature, max_tokens, top_p)
+    if not refresh:
+        cached = report_cache.get(key, max_age=REPORT_CACHE_TTL)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    for delta in _stream_completion(auth_token, messages, REPORT_MODEL, temperature, max_tokens, top_p):
+        parts.append(delta)
+        yield delta
+    report_cache.set(key, ''.join(parts))
+
+
+# Streaming version of get_agricultural_chat
+def stream_agricultural_chat(auth_token, user_input, location, df1, df2, temperature=0.3, max_tokens=4096, top_p=0.9,
+                             climate_df=None):
+    messages = _chat_messages(user_input, location, df1, df2, climate_df)
+    yield from _stream_completion(auth_token, messages, CHAT_MODEL, temperature, max_tokens, top_p)
+
+
+# Token counts reported by the service, when it sends them
+def _record_usage(span, usage):
+    if usage is not None:
+        span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+
+# The completion slot is held until the whole stream has been read.
+# The span is ended by hand because the generator is consumed by someone else.
+def _stream_completion(auth_token, messages, model, temperature, max_tokens, top_p):
+    client = _create_client(auth_token)
+    span = metrics.start_span('llm', model=model, stream=True)
+    chunks = 0
+    try:
+        with llm_pool.completion_slot(model):
+            start = time.perf_counter()
+            first_token = True
+            response = client.complete(
+                stream=True,
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p
+            )
+            try:
+                for update in response:
+                    if getattr(update, 'usage', None):
+                        _record_usage(span, update.usage)
+                    if not update.choices or not update.choices[0].delta.content:
+                        continue
+                    if first_token:
+                        ttft = time.perf_counter() - start
+                        metrics.observe('llm_time_to_first_token_seconds', ttft, model=model)
+                        span.set(time_to_first_token_s=ttft)
+                        first_token = False
+                    chunks += 1
+                    yield update.choices[0].delta.content
+            finally:
+                response.close()
+    except BaseException as e:
+        # GeneratorExit means the reader stopped early, not that the completion failed
+        if not isinstance(e, GeneratorExit):
+            span.fail(e)
+        raise
+    finally:
+        span.set(chunks=chunks)
+        span.end()
+
+
+# Group streamed text into sections, yielding each one as soon as its --- separator arrives.
+# Whatever is left when the stream ends is yielded as the last section.
+def iter_sections(deltas, name='report'):
+    start = time.perf_counter()
+    first_section = True
+    buffer = ''
+    for delta in deltas:
+        buffer += delta
+        while SECTION_SEPARATOR in buffer:
+            section, buffer = buffer.split(SECTION_SEPARATOR, 1)
+            if first_section:
+                metrics.observe('llm_time_to_first_section_seconds', time.perf_counter() - start, stream=name)
+                first_section = False
+            yield section
+    if buffer.strip():
+        yield buffer
@@ -0,0 +1,182 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+# Pollen and weather on one time axis, and correlations kept as running sums.
+#
+# Ambee reports hourly (epoch seconds, UTC), WeatherAPI daily (local dates), so both are
+# bucketed to local days and joined on the day. Correlations come from per-pair sums (count,
+# sum, sum of squares, cross products) that rows can be added to and removed from, so a
+# CorrelationTracker only touches the days that were added, changed or dropped since its last
+# update instead of recomputing corr() over the whole history.
+
+POLLEN_COLUMN = 'Count.weed_pollen'
+WEATHER_COLUMNS = ['Avg Temperature (°C)', 'Avg Humidity (%)']
+COLUMNS = [POLLEN_COLUMN] + WEATHER_COLUMNS
+
+TRACKERS = 32  # correlation trackers kept, one per place and window
+# Only the last days of a frame get revised (today, forecasts); older days are compared by
+# date alone, so an update costs O(days) for the dates plus the few recent rows
+REVISION_DAYS = 7
+
+
+# Ambee 'time' as local naive datetimes (the rows carry their IANA timezone)
+def _local_times(pollen_df):
+    times = pollen_df['time']
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        times = pd.to_datetime(times, unit='s')
+    timezone = pollen_df['timezone'].iloc[0] if 'timezone' in pollen_df and len(pollen_df) else None
+    if timezone and times.dt.tz is None:
+        try:
+            times = times.dt.tz_localize('UTC').dt.tz_convert(timezone).dt.tz_localize(None)
+        except (TypeError, ValueError, KeyError):
+            pass  # unknown zone name, stay on UTC days
+    return times
+
+
+# Daily mean weed pollen and daily weather side by side, one row per day both sources cover
+def align_daily(pollen_df, weather_df):
+    if pollen_df.empty or weather_df.empty:
+        return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name='Date'), dtype=np.float64)
+
+    days = _local_times(pollen_df).dt.normalize()
+    pollen = pollen_df[POLLEN_COLUMN].astype(np.float64).groupby(days.to_numpy()).mean()
+
+    # The real-time row comes before the day's own row, last() keeps the daily figures
+    weather = weather_df[['Date'] + WEATHER_COLUMNS].dropna(subset=['Date'])
+    weather = weather.groupby('Date', sort=True)[WEATHER_COLUMNS].last().astype(np.float64)
+
+    aligned = weather.join(pollen.rename(POLLEN_COLUMN), how='inner')[COLUMNS]
+    aligned.index = pd.DatetimeIndex(aligned.index, name='Date')
+    return aligned
+
+
+def _days(index):
+    return np.asarray(index, dtype='datetime64[us]').view(np.int64)
+
+
+# Where each day of new sits in old (-1 for days old doesn't have), both sorted int64 days
+def _positions(old_days, new_days):
+    if not len(old_days):
+        return np.full(len(new_days), -1)
+    at = np.searchsorted(old_days, new_days)
+    found = old_days[np.minimum(at, len(old_days) - 1)] == new_days
+    return np.where(found, at, -1)
+
+
+class RunningCorrelation:
+    def __init__(self, columns):
+        self.columns = list(columns)
+        k = len(self.columns)
+        # [i, j] entries only count rows where columns i and j are both present (like corr())
+        self._n = np.zeros((k, k))
+        self._sx = np.zeros((k, k))
+        self._sxx = np.zeros((k, k))
+        self._sxy = np.zeros((k, k))
+        self._shift = None  # first rows' means, subtracted so the sums stay small
+
+    def _sums(self, values):
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(self.columns))
+        valid = ~np.isnan(values)
+        if self._shift is None:
+            counts = valid.sum(axis=0)
+            self._shift = np.where(counts > 0, np.where(valid, values, 0).sum(axis=0) / np.maximum(counts, 1), 0)
+        mask = valid.astype(np.float64)
+        x = np.where(valid, values - self._shift, 0.0)
+        return mask.T @ mask, x.T @ mask, (x * x).T @ mask, x.T @ x
+
+    # Add rows (an array or DataFrame with the columns in order)
+    def add(self, values):
+        if len(values):
+            n, sx, sxx, sxy = self._sums(values)
+            self._n += n
+            self._sx += sx
+            self._sxx += sxx
+            self._sxy += sxy
+
+    # Take back rows added earlier
+    def remove(self, values):
+        if len(values):
+            n, sx, sxx, sxy = self._sums(values)
+            self._n -= n
+            self._sx -= sx
+            self._sxx -= sxx
+            self._sxy -= sxy
+
+    # Pearson correlation matrix as a DataFrame, NaN where a pair has too few rows or no variance
+    def corr(self):
+        n, sx, sxx = self._n, self._sx, self._sxx
+        cov = n * self._sxy - sx * sx.T
+        var = (n * sxx - sx ** 2) * (n * sxx.T - sx.T ** 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = cov / np.sqrt(var)
+        r[(n < 2) | ~(var > 0)] = np.nan
+        return pd.DataFrame(np.clip(r, -1, 1), index=self.columns, columns=self.columns)
+
+    def count(self):
+        return int(self._n.diagonal().min()) if len(self.columns) else 0
+
+
+# Correlations over an aligned daily frame that changes a little between updates
+class CorrelationTracker:
+    def __init__(self, columns=COLUMNS, window=None):
+        self.columns = list(columns)
+        self.window = window  # days, None for every day in the frame
+        self.stats = RunningCorrelation(self.columns)
+        self._days = np.empty(0, dtype=np.int64)
+        self._values = np.empty((0, len(self.columns)))
+        self._lock = threading.Lock()
+
+    # Bring the sums in line with aligned (rows indexed by day) and return the correlation matrix
+    def update(self, aligned):
+        aligned = aligned[self.columns].sort_index()
+        if self.window is not None and len(aligned):
+            aligned = aligned[aligned.index > aligned.index.max() - pd.Timedelta(days=self.window)]
+        days, values = _days(aligned.index), aligned.to_numpy(dtype=np.float64)
+        with self._lock:
+            # Rows before the revision horizon are taken as unchanged when their days are
+            settled = 0
+            if len(self._days):
+                horizon = self._days[-1] - REVISION_DAYS * 86_400_000_000
+                settled = int(np.searchsorted(self._days, horizon))
+                if len(days) < settled or not np.array_equal(days[:settled], self._days[:settled]):
+                    settled = 0
+            updated = self._apply(self._days[settled:], self._values[settled:], days[settled:], values[settled:])
+            metrics.increment('correlation_rows_updated_total', updated)
+            self._days, self._values = days, values
+            return self.stats.corr()
+
+    # Move the sums from the old rows to the new ones, returns how many rows were added or changed
+    def _apply(self, old_days, old_values, days, values):
+        positions = _positions(old_days, days)
+        known = positions >= 0
+        before, after = old_values[positions[known]], values[known]
+        changed = ~((before == after) | (np.isnan(before) & np.isnan(after))).all(axis=1)
+        dropped = np.ones(len(old_days), dtype=bool)
+        dropped[positions[known]] = False
+
+        self.stats.remove(old_values[dropped])
+        self.stats.remove(before[changed])
+        self.stats.add(after[changed])
+        self.stats.add(values[~known])
+        return int(changed.sum()) + int((~known).sum())
+
+
+_trackers = OrderedDict()
+_trackers_lock = threading.Lock()
+
+
+# Correlation matrix for aligned (see align_daily), updated incrementally per key (e.g. the place)
+def correlation(key, aligned, window=None):
+    with _trackers_lock:
+        tracker = _trackers.get((key, window))
+        if tracker is None:
+            tracker = _trackers[(key, window)] = CorrelationTracker(window=window)
+        _trackers.move_to_end((key, window))
+        while len(_trackers) > TRACKERS:
+            _trackers.popitem(last=False)
+    return tracker.update(aligned)
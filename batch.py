@@ -0,0 +1,129 @@
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+import http_client
+import snapshots
+from pollen import get_combined_pollen_data
+from weather import get_combined_weather_data
+
+# Batch pipeline for many farms at once:
+#
+#   python batch.py farms.csv -o farms.parquet
+#
+# farms.csv needs the columns name, location, latitude, longitude. Weather (WeatherAPI + NASA
+# POWER) and pollen (Ambee) data for every farm end up in one Parquet file with a Farm and a
+# Source column. A farm that fails is reported and skipped, the rest of the batch keeps going.
+# Data served from a stale snapshot because its provider failed (see snapshots.py) is kept,
+# with the providers it is stale for in the Stale column (empty when fresh).
+
+FARM_COLUMNS = ['name', 'location', 'latitude', 'longitude']
+
+# Default number of requests in flight per provider
+DEFAULT_CONCURRENCY = {'weatherapi': 16, 'nasa': 4, 'ambee': 8}
+
+
+def read_farms(path):
+    farms = pd.read_csv(path)
+    farms.columns = [col.strip().lower() for col in farms.columns]
+    missing = [col for col in FARM_COLUMNS if col not in farms.columns]
+    if missing:
+        raise ValueError(f"{path} is missing the column(s): {', '.join(missing)}")
+    return farms[FARM_COLUMNS].to_dict('records')
+
+
+# Run the weather and pollen pipelines for one farm, returns (frames, errors)
+def fetch_farm(farm):
+    frames = []
+    errors = []
+
+    try:
+        with snapshots.track() as stale:
+            _, weather_df = get_combined_weather_data(farm['location'], farm['latitude'], farm['longitude'])
+        if weather_df.empty:
+            errors.append('weather: no data')
+        else:
+            frames.append(weather_df.assign(Source='weather', Stale=','.join(sorted(stale))))
+    except Exception as e:
+        errors.append(f'weather: {e}')
+
+    try:
+        with snapshots.track() as stale:
+            pollen_df = get_combined_pollen_data(farm['location'])
+        if pollen_df.empty:
+            errors.append('pollen: no data')
+        else:
+            frames.append(pollen_df.assign(Source='pollen', Stale=','.join(sorted(stale))))
+    except Exception as e:
+        errors.append(f'pollen: {e}')
+
+    return [frame.assign(Farm=farm['name']) for frame in frames], errors
+
+
+def run_batch(farms, workers=16, concurrency=None):
+    for provider, limit in {**DEFAULT_CONCURRENCY, **(concurrency or {})}.items():
+        http_client.set_max_in_flight(provider, limit)
+
+    frames = []
+    failures = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_farm, farm): farm['name'] for farm in farms}
+        for future in as_completed(futures):
+            farm_frames, errors = future.result()
+            frames.extend(farm_frames)
+            if errors:
+                failures[futures[future]] = errors
+    elapsed = time.perf_counter() - start
+
+    combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    stale_farms = combined.loc[combined['Stale'] != '', 'Farm'].nunique() if frames else 0
+    report = {
+        'farms': len(farms),
+        'failed_farms': len(failures),
+        'stale_farms': int(stale_farms),
+        'rows': len(combined),
+        'seconds': round(elapsed, 3),
+        'farms_per_second': round(len(farms) / elapsed, 2) if elapsed else None,
+        'failures': failures,
+    }
+    return combined, report
+
+
+def _write_parquet(df, path):
+    # Object columns can mix strings and numbers across sources, store them as text
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].map(lambda v: None if pd.isna(v) else str(v))
+    df.to_parquet(path, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch weather, NASA POWER and pollen data for a list of farms")
+    parser.add_argument('farms', help="CSV with the columns name, location, latitude, longitude")
+    parser.add_argument('-o', '--output', default='farms.parquet', help="Parquet file to write")
+    parser.add_argument('--workers', type=int, default=16, help="farms processed at the same time")
+    for provider, limit in DEFAULT_CONCURRENCY.items():
+        parser.add_argument(f'--{provider}-concurrency', type=int, default=limit,
+                            help=f"max requests in flight to {provider} (default {limit})")
+    args = parser.parse_args(argv)
+
+    farms = read_farms(args.farms)
+    concurrency = {provider: getattr(args, f'{provider}_concurrency') for provider in DEFAULT_CONCURRENCY}
+    combined, report = run_batch(farms, workers=args.workers, concurrency=concurrency)
+
+    if not combined.empty:
+        _write_parquet(combined, args.output)
+    for name, errors in report['failures'].items():
+        print(f"FAILED {name}: {'; '.join(errors)}", file=sys.stderr)
+    print(json.dumps({key: value for key, value in report.items() if key != 'failures'}))
+    return 0 if report['failed_farms'] < report['farms'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
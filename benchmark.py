@@ -0,0 +1,297 @@
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import plotly
+
+import AI
+import charts
+import http_client
+import stub_server
+from endpoints import base_url
+from pollen import WINDOW_AFTER, WINDOW_BEFORE
+from pollen_store import FORECAST, OBSERVED, PollenStore
+from frames import daily_series
+from weather import build_weather_frames
+
+# Stage-by-stage timing of the data pipeline against the local stub server:
+#
+#   python benchmark.py -o bench.json
+#   python benchmark.py --sizes 1,100,10000 --compare bench.json
+#
+# A size is a number of farm-days. Every farm stands for DAYS_PER_FARM days of weather, so
+# 10,000 farm-days is 1,000 farms. Each stage is timed on its own, with the inputs prepared
+# by the stage before it:
+#
+#   fetch        raw HTTP responses (WeatherAPI current, one history call per past day and one
+#                forecast call, NASA POWER, Ambee)
+#   parse        json.loads of every response body
+#   frames       weather.build_weather_frames and a pollen store upsert and window read (like
+#                pollen.get_combined_pollen_data) per farm, then one concat
+#   figures      the three dashboard figures from charts.py
+#   figure_json  serializing those figures, which is what st.plotly_chart sends to the browser
+#   prompt       the report prompt (AI._report_messages)
+#
+# Results are written as JSON; --compare prints the change against an earlier run and exits
+# with 1 when a stage got slower than --tolerance allows.
+
+SIZES = [1, 10, 100, 1000, 10000]
+STAGES = ['fetch', 'parse', 'frames', 'figures', 'figure_json', 'prompt']
+
+# 7 days of history plus 3 forecast days, like the dashboard: a farm's first HISTORY_DAYS
+# farm-days are history calls, the rest one forecast call for that many days
+HISTORY_DAYS = 7
+DAYS_PER_FARM = 10
+
+# Figure options used for every run (the defaults of the Advance Tweaks panel)
+CHART_OPTIONS = {'chart_color': '#dad6c9', 'line_style': 'solid', 'y_axis_range_temp': (10, 40),
+                 'y_axis_range_humidity': (20, 80), 'show_grid': True}
+
+
+def _fetch_all(requests_, workers):
+    def fetch(request):
+        provider, url, params = request
+        response = http_client.get(provider, url, params=params)
+        response.raise_for_status()
+        return response.content
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fetch, requests_))
+
+
+# The HTTP requests behind a number of farm-days, grouped per farm
+def plan_requests(farm_days):
+    farms = []
+    today = datetime.now()
+    for farm in range(math.ceil(farm_days / DAYS_PER_FARM)):
+        days = min(DAYS_PER_FARM, farm_days - farm * DAYS_PER_FARM)
+        history_days = min(days, HISTORY_DAYS)
+        forecast_days = days - history_days
+        location = f'Farm {farm}'
+        latitude, longitude = 26.0 + (farm % 50) * 0.1, 50.0 + (farm // 50) * 0.1
+        dates = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(history_days)]
+        farms.append({
+            'place': location,
+            'dates': dates,
+            'current': ('weatherapi', f"{base_url('weatherapi')}/current.json", {'q': location}),
+            'history': [('weatherapi', f"{base_url('weatherapi')}/history.json", {'q': location, 'dt': date})
+                        for date in dates],
+            'forecast': [('weatherapi', f"{base_url('weatherapi')}/forecast.json",
+                          {'q': location, 'days': forecast_days})] if forecast_days else [],
+            'nasa': ('nasa', f"{base_url('nasa')}/temporal/daily/point", {
+                'start': (today - timedelta(days=history_days - 1)).strftime('%Y%m%d'),
+                'end': (today + timedelta(days=max(forecast_days - 1, 0))).strftime('%Y%m%d'),
+                'latitude': latitude, 'longitude': longitude, 'parameters': 'PRECTOTCORR'}),
+            'pollen': [('ambee', f"{base_url('ambee')}/latest/pollen/by-place", {'place': location}),
+                       ('ambee', f"{base_url('ambee')}/forecast/pollen/by-place", {'place': location})],
+        })
+    return farms
+
+
+def _flatten(farms):
+    requests_ = []
+    for farm in farms:
+        requests_.append(farm['current'])
+        requests_.extend(farm['history'])
+        requests_.extend(farm['forecast'])
+        requests_.append(farm['nasa'])
+        requests_.extend(farm['pollen'])
+    return requests_
+
+
+# Regroup a flat list (in _flatten order) per farm
+def _regroup(farms, items):
+    grouped = []
+    i = 0
+    for farm in farms:
+        n = len(farm['history']) + len(farm['forecast'])
+        grouped.append({'place': farm['place'], 'dates': farm['dates'], 'current': items[i],
+                        'history': items[i + 1:i + 1 + len(farm['history'])],
+                        'forecast': items[i + 1 + len(farm['history']):i + 1 + n],
+                        'nasa': items[i + 1 + n], 'pollen': items[i + 2 + n:i + 4 + n]})
+        i += 4 + n
+    return grouped
+
+
+# store is the PollenStore the pollen rows go through
+def build_frames(parsed_farms, store):
+    weather_frames = []
+    pollen_frames = []
+    now = time.time()
+    for farm in parsed_farms:
+        records = [(date, data, data['forecast']['forecastday'][0]['day'])
+                   for date, data in zip(farm['dates'], farm['history'])]
+        forecast = [(day['date'], data, day['day']) for data in farm['forecast']
+                    for day in data['forecast']['forecastday']]
+        precipitation = daily_series(farm['nasa']['properties']['parameter']['PRECTOTCORR'], 'Precipitation (mm)')
+        weather_frames.append(build_weather_frames(farm['current'], records, forecast, precipitation)[1])
+        latest, forecast = (payload.get('data') or [] for payload in farm['pollen'])
+        store.upsert(farm['place'], OBSERVED, latest)
+        store.upsert(farm['place'], FORECAST, forecast)
+        pollen_df = store.window(farm['place'], now - WINDOW_BEFORE, now + WINDOW_AFTER)
+        if not pollen_df.empty:
+            pollen_frames.append(pollen_df)
+    return pd.concat(weather_frames, ignore_index=True), pd.concat(pollen_frames, ignore_index=True)
+
+
+def build_figures(weather_df, pollen_df):
+    pollen_df = pollen_df.assign(time=pd.to_datetime(pollen_df['time'], unit='s'))
+    return [
+        charts.weed_pollen_figure(pollen_df, CHART_OPTIONS['chart_color']),
+        charts.temperature_humidity_figure(weather_df, **CHART_OPTIONS),
+        charts.correlation_heatmap(pollen_df, weather_df),
+    ]
+
+
+def _timed(func, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def _summary(times, farm_days, **extra):
+    median = statistics.median(times)
+    return {
+        'median_s': median,
+        'min_s': min(times),
+        'mean_s': statistics.fmean(times),
+        'runs': len(times),
+        'us_per_farm_day': median / farm_days * 1e6,
+        **extra,
+    }
+
+
+# Time every stage for one size, returns {stage: summary}
+def run_size(farm_days, repeat=3, workers=16):
+    farms = plan_requests(farm_days)
+    requests_ = _flatten(farms)
+    stages = {}
+
+    bodies, times = _timed(lambda: _fetch_all(requests_, workers), repeat)
+    stages['fetch'] = _summary(times, farm_days, requests=len(requests_), bytes=sum(len(body) for body in bodies))
+
+    parsed, times = _timed(lambda: [json.loads(body) for body in bodies], repeat)
+    stages['parse'] = _summary(times, farm_days)
+
+    parsed_farms = _regroup(farms, parsed)
+    with tempfile.TemporaryDirectory() as store_dir:
+        store = PollenStore(os.path.join(store_dir, 'pollen.sqlite3'))
+        (weather_df, pollen_df), times = _timed(lambda: build_frames(parsed_farms, store), repeat)
+        store.close()
+    stages['frames'] = _summary(times, farm_days, weather_rows=len(weather_df), pollen_rows=len(pollen_df))
+
+    figures, times = _timed(lambda: build_figures(weather_df, pollen_df), repeat)
+    stages['figures'] = _summary(times, farm_days)
+
+    payloads, times = _timed(lambda: [figure.to_json() for figure in figures], repeat)
+    stages['figure_json'] = _summary(times, farm_days, bytes=sum(len(payload) for payload in payloads))
+
+    messages, times = _timed(lambda: AI._report_messages(weather_df, pollen_df), repeat)
+    stages['prompt'] = _summary(times, farm_days, chars=sum(len(message.content) for message in messages))
+    return stages
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes=SIZES, repeat=3, workers=16, log=print):
+    # Untimed warm-up, so the first size doesn't pay for connection setup and plotly's first use
+    run_size(1, repeat=1, workers=workers)
+    results = []
+    for farm_days in sizes:
+        stages = run_size(farm_days, repeat=repeat, workers=workers)
+        results.append({'farm_days': farm_days, 'farms': math.ceil(farm_days / DAYS_PER_FARM), 'stages': stages})
+        log(f"{farm_days:>6} farm-days  " + '  '.join(f"{stage} {stages[stage]['median_s'] * 1000:8.1f}ms"
+                                                      for stage in STAGES))
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                        'plotly': plotly.__version__, 'machine': platform.machine()},
+        'options': {'repeat': repeat, 'workers': workers, 'days_per_farm': DAYS_PER_FARM},
+        'results': results,
+    }
+
+
+# Median change per (size, stage) against an earlier run: [(farm_days, stage, old, new, ratio)]
+def compare(baseline, current):
+    old = {(result['farm_days'], stage): summary['median_s']
+           for result in baseline['results'] for stage, summary in result['stages'].items()}
+    rows = []
+    for result in current['results']:
+        for stage, summary in result['stages'].items():
+            before = old.get((result['farm_days'], stage))
+            if before:
+                rows.append((result['farm_days'], stage, before, summary['median_s'], summary['median_s'] / before))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline stage by stage against the stub server")
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help="comma separated farm-day counts")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage, the median is reported")
+    parser.add_argument('--workers', type=int, default=16, help="requests in flight during the fetch stage")
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="with --compare, fail when a stage is this much slower (0.2 = 20%%)")
+    parser.add_argument('--stub-url', help="use an already running stub server instead of starting one")
+    parser.add_argument('--latency', type=float, default=0.0, help="latency the started stub server adds")
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.stub_url:
+        os.environ['FARMERS_AID_STUB_URL'] = args.stub_url
+    else:
+        server, url = stub_server.start_in_background(latency=args.latency)
+        os.environ['FARMERS_AID_STUB_URL'] = url
+    try:
+        results = run_benchmark([int(size) for size in args.sizes.split(',')], repeat=args.repeat,
+                                workers=args.workers)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = 0
+        print(f"Compared with {baseline.get('commit') or args.compare}:")
+        for farm_days, stage, before, after, ratio in compare(baseline, results):
+            slower = ratio > 1 + args.tolerance
+            regressions += slower
+            print(f"{farm_days:>6} {stage:<12} {before * 1000:9.1f}ms -> {after * 1000:9.1f}ms  "
+                  f"{(ratio - 1) * 100:+6.1f}%{'  SLOWER' if slower else ''}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
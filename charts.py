@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+import alignment
+import metrics
+from downsample import downsample
+
+# Figures shown on the dashboard. Kept apart from main.py so they can be built (and timed,
+# see benchmark.py) without a running Streamlit app.
+#
+# Streamlit reruns main.py on every widget change. cached() keeps the last FIGURE_CACHE_SIZE
+# figures keyed by the version of their data and their style options, so moving the humidity
+# slider rebuilds the temperature chart only. This saves build time only: a rebuilt figure
+# serializes to the same bytes as the one it replaces, so it crosses the websocket just the same.
+
+FIGURE_CACHE_SIZE = 32
+
+_figures = OrderedDict()
+_figures_lock = threading.Lock()
+
+
+# Content hash of a DataFrame: same values, index and columns give the same version
+def data_version(df):
+    try:
+        hashed = pd.util.hash_pandas_object(df, index=True)
+    except TypeError:  # unhashable cells, e.g. lists left in by json_normalize
+        hashed = pd.util.hash_pandas_object(df.astype(str), index=True)
+    return tuple(df.columns), len(df), int(hashed.sum())
+
+
+# build(*args), reusing the figure from an earlier call with the same data and options.
+# The figure is shared, so callers must not change it.
+def cached(build, *args):
+    key = (build.__name__,) + tuple(data_version(arg) if isinstance(arg, pd.DataFrame) else arg for arg in args)
+    with _figures_lock:
+        fig = _figures.get(key)
+        if fig is not None:
+            _figures.move_to_end(key)
+    if fig is not None:
+        metrics.increment('cache_hits_total', cache='figures')
+        return fig
+
+    metrics.increment('cache_misses_total', cache='figures')
+    fig = build(*args)
+    with _figures_lock:
+        _figures[key] = fig
+        while len(_figures) > FIGURE_CACHE_SIZE:
+            _figures.popitem(last=False)
+    return fig
+
+
+# Line plot for weed pollen count (pollen_df['time'] already converted to datetimes).
+# Long series are downsampled to about one point per pixel, see downsample.py.
+@metrics.traced('figure')
+def weed_pollen_figure(pollen_df, chart_color):
+    pollen_df = downsample(pollen_df, 'time', 'Count.weed_pollen')
+    fig = px.line(pollen_df, x='time', y='Count.weed_pollen',
+                  labels={'Count.weed_pollen': 'Weed Pollen Count', 'time': 'Time'},
+                  title="Weed Pollen Counts Over Time",
+                  line_shape="linear")
+    fig.update_traces(line=dict(color=chart_color))
+    return fig
+
+
+# Temperature and humidity trends on two y axes (downsampled like the pollen chart)
+@metrics.traced('figure')
+def temperature_humidity_figure(weather_df, chart_color, line_style, y_axis_range_temp, y_axis_range_humidity,
+                                show_grid):
+    weather_df = downsample(weather_df, 'Date', ['Avg Temperature (°C)', 'Avg Humidity (%)'])
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=weather_df['Date'], y=weather_df['Avg Temperature (°C)'],
+        mode='lines',
+        line=dict(dash=line_style, color='#A3AB30'),
+        hovertemplate='Temperature: %{y:.2f} °C<br>Date: %{x}<extra></extra>',
+        yaxis='y1'
+    ))
+    fig.add_trace(go.Scatter(
+        x=weather_df['Date'], y=weather_df['Avg Humidity (%)'],
+        mode='lines',
+        line=dict(dash=line_style, color=chart_color),
+        hovertemplate='Humidity: %{y:.2f} %<br>Date: %{x}<extra></extra>',
+        yaxis='y2'
+    ))
+
+    fig.update_layout(
+        title="",
+        xaxis_title="",
+        yaxis=dict(title="", range=y_axis_range_temp,
+                   titlefont=dict(color=chart_color), tickfont=dict(color=chart_color)),
+        yaxis2=dict(title="", range=y_axis_range_humidity,
+                    titlefont=dict(color=chart_color), tickfont=dict(color=chart_color),
+                    overlaying='y', side='right'),
+        showlegend=False,
+        xaxis_showgrid=show_grid,
+        yaxis_showgrid=show_grid
+    )
+    return fig
+
+
+# Correlation heatmap of daily weed pollen against temperature and humidity (see alignment.py).
+# With a key (the place) the correlations are updated incrementally from the previous call's.
+@metrics.traced('figure')
+def correlation_heatmap(pollen_df, weather_df, key=None):
+    aligned = alignment.align_daily(pollen_df, weather_df)
+    corr_matrix = aligned.corr() if key is None else alignment.correlation(key, aligned)
+    fig = go.Figure(data=go.Heatmap(
+        z=corr_matrix.values,
+        x=corr_matrix.columns,
+        y=corr_matrix.columns,
+        colorscale='Viridis'
+    ))
+    fig.update_layout(
+        title=f'Correlation Heatmap ({len(aligned)} days)',
+        xaxis_title='Variables',
+        yaxis_title='',
+        yaxis=dict(showticklabels=False)
+    )
+    return fig
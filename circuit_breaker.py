@@ -0,0 +1,105 @@
+import threading
+import time
+
+import requests
+
+import metrics
+
+# One circuit breaker per upstream provider, used by http_client.get.
+#
+#   closed     calls go through; FAILURE_THRESHOLD failures in a row (timeouts, connection
+#              errors, 429/5xx once urllib3 gave up retrying) open the breaker
+#   open       calls fail straight away with CircuitOpen instead of waiting on the provider,
+#              so callers fall back to what they have (see snapshots.py)
+#   half_open  after RESET_TIMEOUT one probe call is let through: success closes the breaker,
+#              failure opens it again for another RESET_TIMEOUT
+#
+# The state of every breaker is the circuit_state gauge (0 closed, 1 half open, 2 open).
+
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30  # seconds
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+# A RequestException, so every fetcher already treats it as a failed call
+class CircuitOpen(requests.RequestException):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, provider, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+        metrics.set_gauge('circuit_state', STATE_VALUES[CLOSED], provider=provider)
+
+    # Raise CircuitOpen unless a call may go out now
+    def allow(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return
+            # Only one probe at a time; a probe that never reported back is replaced
+            if self.state == HALF_OPEN and (self._probe_started is None
+                                            or now - self._probe_started >= self.reset_timeout):
+                self._probe_started = now
+                return
+        metrics.increment('circuit_rejected_total', provider=self.provider)
+        raise CircuitOpen(f"{self.provider} is failing, calls are paused for up to {self.reset_timeout}s")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probe_started = None
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_started = None
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+                metrics.increment('circuit_opened_total', provider=self.provider)
+
+    # Back to closed, e.g. after the provider's settings changed
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self._probe_started = None
+            self._set_state(CLOSED)
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.set_gauge('circuit_state', STATE_VALUES[state], provider=self.provider)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+# Get (or create) the breaker for a provider
+def breaker(provider):
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+
+# Providers whose breaker is not closed: {provider: state}
+def open_providers():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.provider: b.state for b in breakers if b.state != CLOSED}
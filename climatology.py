@@ -0,0 +1,261 @@
+import functools
+import glob
+import os
+import threading
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import metrics
+import nasa_grid
+import nasa_ingest
+
+# Day-of-year normals, percentiles and anomalies computed with NumPy on the multi-year
+# NASA POWER history stored by nasa_ingest. The history is laid out as a (years, 366)
+# matrix per parameter; the samples for a day of year are the values of all years within
+# +-WINDOW_DAYS of it. The sorted samples are written next to the history once per ingest
+# and memory-mapped afterwards, so answering "what percentile is today's humidity" is a
+# row lookup, for one location or for thousands stacked into one array.
+
+WINDOW_DAYS = 7
+PERCENTILES = (10, 50, 90)
+
+# Dashboard columns and the POWER parameter that measures the same thing. Not precipitation:
+# the dashboard's column is clipped to [0.01, 0.99] mm (see weather.py), so it can't be ranked
+# against PRECTOTCORR history.
+WEATHER_PARAMETERS = {
+    'Avg Temperature (°C)': 'T2M',
+    'Avg Humidity (%)': 'RH2M',
+}
+
+
+# Slot 0..365 of each date in a leap-year calendar, so Feb 29 has its own slot
+def day_slots(dates):
+    dates = pd.DatetimeIndex(dates)
+    return np.asarray(pd.to_datetime({'year': 2000, 'month': dates.month, 'day': dates.day}).dt.dayofyear - 1)
+
+
+# Reshape a daily series into a (years, 366) matrix, NaN where there is no value
+def year_matrix(dates, values):
+    dates = pd.DatetimeIndex(dates)
+    years = dates.year - dates.year.min()
+    matrix = np.full((years.max() + 1, 366), np.nan, dtype=np.float32)
+    matrix[np.asarray(years), day_slots(dates)] = values
+    return matrix
+
+
+# Sorted samples for every day of year: (years, 366) -> (366, years * (2 * window + 1)), NaNs last
+def window_samples(matrix, window=WINDOW_DAYS):
+    padded = np.concatenate([matrix[:, -window:], matrix, matrix[:, :window]], axis=1)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * window + 1, axis=1)
+    samples = np.moveaxis(windows, 0, 1).reshape(366, -1)
+    return np.sort(samples, axis=-1)
+
+
+# Percentile rank (0-100) of values within sorted samples, along the last axis; NaN for a
+# NaN value or no samples
+def percentile_rank(samples, values):
+    values = np.asarray(values, dtype=np.float32)[..., None]
+    counts = np.isfinite(samples).sum(axis=-1)
+    below = (samples < values).sum(axis=-1)
+    equal = (samples == values).sum(axis=-1)
+    with np.errstate(all='ignore'):
+        return np.where((counts > 0) & np.isfinite(values[..., 0]), 100.0 * (below + 0.5 * equal) / counts, np.nan)
+
+
+# Linear-interpolated percentile read straight from sorted samples
+# (np.nanpercentile gives the same result but loops row by row)
+def sorted_percentile(samples, p):
+    counts = np.isfinite(samples).sum(axis=-1)
+    last = np.maximum(counts - 1, 0)
+    position = last * (p / 100.0)
+    lower = np.floor(position).astype(np.intp)
+    upper = np.minimum(lower + 1, last)
+    low_values = np.take_along_axis(samples, lower[..., None], axis=-1)[..., 0]
+    high_values = np.take_along_axis(samples, upper[..., None], axis=-1)[..., 0]
+    return np.where(counts > 0, low_values + (high_values - low_values) * (position - lower), np.nan)
+
+
+def _mean(samples):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # days without any samples are NaN
+        return np.nanmean(samples, axis=-1)
+
+
+class Climatology:
+    # samples: sorted (366, n) array as returned by window_samples
+    def __init__(self, samples):
+        self.samples = samples
+        self.mean = _mean(samples)
+        self.percentiles = {p: sorted_percentile(samples, p) for p in PERCENTILES}
+
+    @classmethod
+    def from_series(cls, dates, values, window=WINDOW_DAYS):
+        return cls(window_samples(year_matrix(dates, values), window))
+
+    def percentile_of(self, value, slot):
+        return float(percentile_rank(self.samples[slot], value))
+
+    def normal(self, slot):
+        return float(self.mean[slot])
+
+    def anomaly(self, value, slot):
+        return float(value) - self.normal(slot)
+
+
+# Memory-mapped sorted samples of one parameter for a location, None if never ingested.
+# Computed from the stored history the first time after each ingest and kept on disk.
+def stored_samples(latitude, longitude, parameter):
+    meta = nasa_ingest.read_meta(latitude, longitude)
+    if meta is None or parameter not in meta['parameters']:
+        return None
+    path = nasa_ingest.cell_dir(latitude, longitude)
+    version = f"{meta['days']}-{meta.get('updated_at', '')}".replace(':', '')
+    samples_path = os.path.join(path, f'{parameter}.samples-w{WINDOW_DAYS}-{version}.npy')
+    if not os.path.exists(samples_path):
+        # Other versions are stale; another session may have written this one in the meantime
+        for old in glob.glob(os.path.join(path, f'{parameter}.samples-*.npy')):
+            if old != samples_path:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+        dates, arrays = nasa_ingest.load_history(latitude, longitude, [parameter])
+        # A temporary name of our own (not matching the glob above), so concurrent writers
+        # don't remove each other's file before it is moved in place
+        tmp = f'{samples_path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, window_samples(year_matrix(dates, arrays[parameter])))
+        os.replace(tmp, samples_path)
+    return _open_samples(samples_path)
+
+
+# The file name carries the version, so an open memory map can be reused until it changes
+@functools.lru_cache(maxsize=4096)
+def _open_samples(samples_path):
+    return np.load(samples_path, mmap_mode='r')
+
+
+# Climatology of one parameter for a location, None if its history was never ingested
+def for_location(latitude, longitude, parameter):
+    meta = nasa_ingest.read_meta(latitude, longitude)
+    if meta is None or parameter not in meta['parameters']:
+        return None
+    return _cached_climatology(meta['latitude'], meta['longitude'], parameter, meta['days'], meta.get('updated_at'))
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_climatology(latitude, longitude, parameter, days, updated_at):
+    return Climatology(stored_samples(latitude, longitude, parameter))
+
+
+RELOAD_CHECK_EVERY = 60  # seconds between checks of a cell for a newer ingest
+
+_cells_lock = threading.Lock()
+_cells = {}  # (cell, parameter) -> (meta.json mtime, when it was checked, memory-mapped samples)
+
+
+# Sorted samples of one parameter for a grid cell center, None if never ingested. Loaded once
+# per ingest: later calls look at meta.json's modification time at most every
+# RELOAD_CHECK_EVERY seconds.
+def _cell_samples(cell, parameter, now):
+    cached = _cells.get((cell, parameter))
+    if cached is not None and now - cached[1] < RELOAD_CHECK_EVERY:
+        return cached[2]
+    try:
+        mtime = os.stat(os.path.join(nasa_ingest.cell_dir(*cell), 'meta.json')).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if cached is None or cached[0] != mtime:
+        samples = None if mtime is None else stored_samples(cell[0], cell[1], parameter)
+    else:
+        samples = cached[2]
+    with _cells_lock:
+        _cells[(cell, parameter)] = (mtime, now, samples)
+    return samples
+
+
+# Normals, anomalies and percentile ranks of one reading per location, all in one array
+# operation: only the day-of-year row of each location's samples is read from disk.
+# Locations without stored history get NaN.
+def assess_batch(points, parameter, values, when=None):
+    slot = day_slots([pd.Timestamp(when or pd.Timestamp.now().normalize())])[0]
+
+    # Points in the same grid cell share one history: snap them all at once and read each
+    # cell's row once
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    snapped = np.column_stack([
+        np.round(np.round(points[:, 0] / nasa_grid.GRID_LAT_STEP) * nasa_grid.GRID_LAT_STEP, 4),
+        np.round(np.round(points[:, 1] / nasa_grid.GRID_LON_STEP) * nasa_grid.GRID_LON_STEP, 4),
+    ])
+    unique_cells, cell_of_point = np.unique(snapped, axis=0, return_inverse=True)
+    cell_of_point = cell_of_point.reshape(-1)
+    now = time.monotonic()
+    cell_samples = [_cell_samples((float(lat), float(lon)), parameter, now) for lat, lon in unique_cells]
+
+    # Pad to a common width with NaN, which keeps every row sorted (NaNs last)
+    width = max((samples.shape[1] for samples in cell_samples if samples is not None), default=1)
+    cell_rows = np.full((len(unique_cells), width), np.nan, dtype=np.float32)
+    for i, samples in enumerate(cell_samples):
+        if samples is not None:
+            cell_rows[i, :samples.shape[1]] = samples[slot]
+
+    # Normals and percentiles per cell, only the ranks depend on each point's value
+    values = np.asarray(values, dtype=np.float32)
+    normal = _mean(cell_rows)[cell_of_point]
+    result = pd.DataFrame({
+        'Latitude': points[:, 0],
+        'Longitude': points[:, 1],
+        'Value': values,
+        'Normal': normal,
+        'Anomaly': values - normal,
+        'Percentile': percentile_rank(cell_rows[cell_of_point], values),
+    })
+    for p in PERCENTILES:
+        result[f'P{p}'] = sorted_percentile(cell_rows, p)[cell_of_point]
+    return result
+
+
+def _ordinal(n):
+    n = int(round(n))
+    suffix = 'th' if 10 <= n % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+    return f'{n}{suffix}'
+
+
+# Compare the day's values of each dashboard column with its climatology. daily_df holds daily
+# records (the weather frame without its real-time row): POWER normals are daily means and
+# daily totals, so they are compared with WeatherAPI's day aggregates, not a current reading.
+# Returns a DataFrame (Measure, Value, Normal, Anomaly, Percentile, Summary) or None if
+# there is no stored history for the location or no record for the day.
+@metrics.traced('climatology')
+def assess_weather(latitude, longitude, daily_df, when=None):
+    if daily_df is None or daily_df.empty:
+        return None
+    day = pd.Timestamp(when or pd.Timestamp.now()).normalize()
+    slot = day_slots([day])[0]
+    # The forecast's day block comes after the history one, like alignment.align_daily
+    records = daily_df[daily_df['Date'] == day]
+    if records.empty:
+        return None
+
+    rows = []
+    for column, parameter in WEATHER_PARAMETERS.items():
+        climate = for_location(latitude, longitude, parameter)
+        if climate is None or column not in records.columns:
+            continue
+        value = float(records[column].iloc[-1])
+        percentile = climate.percentile_of(value, slot)
+        if np.isnan(percentile):
+            continue
+        name = column.split(' (')[0].replace('Avg ', '').replace('Total ', '')
+        rows.append({
+            'Measure': column,
+            'Value': value,
+            'Normal': climate.normal(slot),
+            'Anomaly': climate.anomaly(value, slot),
+            'Percentile': percentile,
+            'Summary': f'{name} is at the {_ordinal(percentile)} percentile for this week of the year',
+        })
+    return pd.DataFrame(rows) if rows else None
@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import deadline
+import frame_store
+import metrics
+import snapshots
+from pollen import get_combined_pollen_data
+from weather import get_combined_weather_data
+
+# Cached data layer the dashboard reads from. Streamlit reruns main.py on every widget
+# change, so without this moving a slider would refetch every API. Entries are keyed by
+# location and a time bucket and also expire after their TTL. The LLM report has its own
+# content-addressed cache in AI.py.
+
+DATA_TTL = 15 * 60  # seconds, weather and pollen
+RENDER_BUDGET = 8  # seconds a render waits on the providers when their data is not cached
+# Frames from the ingestion worker (see ingest_worker.py) are used up to this age; older ones
+# mean the worker is down and the providers are asked directly
+PRECOMPUTED_MAX_AGE = 2 * 60 * 60
+# Worker frames older than this are shown as stale data of every provider in them (the
+# worker only writes frames built from fresh data)
+PRECOMPUTED_FRESH_FOR = 2 * DATA_TTL
+FRAME_PROVIDERS = ('weatherapi', 'nasa', 'ambee')
+
+# Location key -> when it was last refreshed from the dashboard; worker frames written before
+# that are older than what the refresh fetched
+_refreshed = {}
+
+
+# Index of the current time window, passed to the loaders so a new window means a new cache entry
+def time_bucket(seconds=DATA_TTL):
+    return int(time.time() // seconds)
+
+
+# generation is snapshots.generation(): frames built from stale snapshots are rebuilt once a
+# background refresh brought newer data. The loaders also return what the frames were built
+# from stale, {provider: fetch time of the oldest stale data}, cached along with them.
+@st.cache_data(ttl=DATA_TTL, show_spinner="Fetching weather data...")
+def load_weather_data(location, latitude, longitude, bucket, generation=0):
+    with snapshots.track() as stale:
+        real_df, weather_df = get_combined_weather_data(location, latitude, longitude)
+    return real_df, weather_df, dict(stale)
+
+
+@st.cache_data(ttl=DATA_TTL, show_spinner="Fetching pollen data...")
+def load_pollen_data(place, bucket, generation=0):
+    with snapshots.track() as stale:
+        pollen_df = get_combined_pollen_data(place)
+    return pollen_df, dict(stale)
+
+
+# Frames written by the ingestion worker, read once per version
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_precomputed(key, version):
+    return frame_store.read_frames(key)
+
+
+# func for a pool thread: it runs with the caller's span, budget and Streamlit script context
+# (the loaders' spinners need the latter)
+def _in_script_context(func):
+    script_ctx = get_script_run_ctx()
+    bound = metrics.bind_context(func)
+
+    def run(*args, **kwargs):
+        add_script_run_ctx(threading.current_thread(), script_ctx)
+        return bound(*args, **kwargs)
+    return run
+
+
+# Pollen, real-time and weather frames for one render. The ingestion worker's frames when it
+# keeps this location fresh; otherwise the providers are asked within RENDER_BUDGET and the
+# location is registered so the worker takes over. Frames that are missing late calls are not
+# kept, so the next run rebuilds them with whatever arrived since. refresh=True (after
+# refresh()) asks the providers for everything that can have changed, whatever is cached.
+# Returns (pollen_df, real_df, weather_df, names of the calls that missed the deadline,
+# {provider: fetch time of the oldest stale data the frames were built from}).
+def load_dashboard_data(place, location, latitude, longitude, refresh=False):
+    try:
+        key = frame_store.register(location, place, latitude, longitude)
+    except (OSError, ValueError):
+        key = None  # read-only data directory or no coordinates, nothing to precompute
+    if refresh and key:
+        _refreshed[key] = time.time()
+    pointer = frame_store.current(key) if key else None
+    if pointer is not None and pointer['updated_at'] > _refreshed.get(key, 0) and \
+            time.time() - pointer['updated_at'] <= PRECOMPUTED_MAX_AGE:
+        frames = load_precomputed(key, pointer['version'])
+        if frames is not None:
+            stale = {}
+            if time.time() - pointer['updated_at'] > PRECOMPUTED_FRESH_FOR:
+                stale = {provider: pointer['updated_at'] for provider in FRAME_PROVIDERS}
+            return frames['pollen'], frames['real_time'], frames['weather'], set(), stale
+
+    bucket = time_bucket()
+    generation = snapshots.generation()
+    with deadline.budget(RENDER_BUDGET) as render_budget, \
+            snapshots.synchronous(force=True) if refresh else nullcontext():
+        # Both loaders at the same time, so a slow provider doesn't use up the other's budget
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            pollen_future = pool.submit(_in_script_context(load_pollen_data), place, bucket, generation)
+            real_df, weather_df, weather_stale = load_weather_data(location, latitude, longitude, bucket, generation)
+            pollen_df, pollen_stale = pollen_future.result()
+        finally:
+            pool.shutdown(wait=False)
+    if render_budget.missed:
+        load_pollen_data.clear(place, bucket, generation)
+        load_weather_data.clear(location, latitude, longitude, bucket, generation)
+    return pollen_df, real_df, weather_df, render_budget.missed, {**pollen_stale, **weather_stale}
+
+
+# Drop every cached entry; the next load_dashboard_data(..., refresh=True) pulls fresh data
+def refresh():
+    load_weather_data.clear()
+    load_pollen_data.clear()
+    load_precomputed.clear()
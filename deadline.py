@@ -0,0 +1,59 @@
+import contextvars
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+import metrics
+
+# Latency budget for one dashboard render. data_layer opens a budget around the loaders and
+# the fetchers wait for their upstream calls through result(), which gives up once the budget
+# is spent. A call that missed the deadline is not cancelled: it finishes in the background
+# and its response still lands in the snapshot stores, so the next render has it. Without an
+# open budget (batch runs, ingestion) result() simply waits.
+
+_budget = contextvars.ContextVar('budget', default=None)
+
+
+class Budget:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.deadline = self.started + seconds
+        self.missed = set()  # names of the calls that were still running at the deadline
+
+    def remaining(self):
+        return max(self.deadline - time.monotonic(), 0.0)
+
+
+# Run the block within seconds; a budget inside another one can only be shorter
+@contextmanager
+def budget(seconds):
+    current = Budget(seconds)
+    outer = _budget.get()
+    if outer is not None:
+        current.deadline = min(current.deadline, outer.deadline)
+    token = _budget.set(current)
+    try:
+        yield current
+    finally:
+        _budget.reset(token)
+        if outer is not None:
+            outer.missed |= current.missed
+        metrics.observe('render_budget_used_seconds', time.monotonic() - current.started)
+
+
+# Seconds left in the current budget, None without one
+def remaining():
+    current = _budget.get()
+    return None if current is None else current.remaining()
+
+
+# future.result(), or default when the budget runs out first (name says what was left out)
+def result(future, name, default=None):
+    current = _budget.get()
+    try:
+        return future.result(timeout=None if current is None else current.remaining())
+    except FutureTimeout:
+        current.missed.add(name)
+        metrics.increment('deadline_exceeded_total', call=name)
+        return default
@@ -0,0 +1,93 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import metrics
+from endpoints import storage_dir
+
+# Small persistent key/value cache backed by SQLite. Values are stored as zlib
+# compressed JSON, entries carry the time they were written and last read, and
+# the cache evicts least recently used entries once it grows past max_bytes.
+# Caches live under CACHE_DIR, which is kept apart per set of base URL overrides (see
+# endpoints.storage_dir); CACHE_ROOT is for state that is about the real services whatever
+# the overrides, like the daily quota counts.
+
+CACHE_ROOT = os.environ.get('FARMERS_AID_CACHE_DIR', '.cache')
+CACHE_DIR = storage_dir(CACHE_ROOT)
+
+
+class DiskCache:
+    def __init__(self, name, max_bytes=50 * 1024 * 1024, path=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.path = path or os.path.join(CACHE_DIR, f'{name}.sqlite3')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' key TEXT PRIMARY KEY,'
+            ' value BLOB NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' stored_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+        self._conn.commit()
+
+    # Return the cached value, or None if missing or older than max_age seconds
+    def get(self, key, max_age=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, stored_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or (max_age is not None and now - row[1] > max_age):
+                metrics.increment('cache_misses_total', cache=self.name)
+                return None
+            self._conn.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+        metrics.increment('cache_hits_total', cache=self.name)
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, key, value):
+        blob = zlib.compress(json.dumps(value).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (key, value, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (key, blob, len(blob), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM entries')
+            self._conn.commit()
+
+    # Number of entries and total stored bytes
+    def stats(self):
+        with self._lock:
+            count, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {'entries': count, 'bytes': size, 'max_bytes': self.max_bytes}
+
+    # Drop least recently used entries until the cache fits in max_bytes (caller holds the lock)
+    def _evict(self):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute('SELECT key, size FROM entries ORDER BY accessed_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+            evicted += 1
+        metrics.increment('cache_evictions_total', evicted, cache=self.name)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+# Downsampling for the dashboard line charts. Months of hourly pollen or years of daily
+# weather would otherwise send every point to the browser, megabytes per figure. Series
+# longer than MAX_POINTS are cut down with Largest-Triangle-Three-Buckets: the points are
+# split into MAX_POINTS buckets and from each the point that spans the largest triangle with
+# its neighbours is kept, so peaks and dips survive while flat stretches thin out.
+# MAX_POINTS is about one point per pixel of a full-width chart.
+
+MAX_POINTS = 1000
+
+
+def _as_float(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[us]').astype(np.int64).astype(np.float64)
+    return values.astype(np.float64)
+
+
+# Positions of the points LTTB keeps out of (x, y), x sorted; all of them if there are few enough
+def lttb(x, y, threshold=MAX_POINTS):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = _as_float(x)
+    # Gaps are filled for choosing points only, the chart still gets the original values
+    y = pd.Series(_as_float(y)).interpolate(limit_direction='both').fillna(0).to_numpy()
+
+    # Inner buckets between the first and last point, which are always kept
+    edges = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+# Rows of df to draw for an x column and one or more y columns: df itself when it is short
+# enough, otherwise sorted by x and cut down to the points LTTB keeps for any of the y columns
+def downsample(df, x, y, threshold=MAX_POINTS):
+    if len(df) <= threshold:
+        return df
+    df = df.sort_values(x, kind='stable')
+    columns = [y] if isinstance(y, str) else y
+    keep = np.unique(np.concatenate([lttb(df[x].to_numpy(), df[column].to_numpy(), threshold)
+                                     for column in columns]))
+    return df.iloc[keep]
+
+
+# Rows with start <= x <= end, for looking at part of a long series at full resolution
+def window(df, x, start, end):
+    values = df[x]
+    return df[(values >= start) & (values <= end)]
@@ -0,0 +1,39 @@
+import hashlib
+import json
+import os
+
+# Base URL of every upstream service. Each one can be overridden with <PROVIDER>_BASE_URL
+# (e.g. WEATHERAPI_BASE_URL), or all of them at once with FARMERS_AID_STUB_URL, which points
+# the app at stub_server.py (every provider is served under /<provider> there).
+#
+# What is persisted from the providers (snapshots, reports, the pollen and NASA stores, the
+# worker's frames) lives under storage_dir(), so data from a stub or any other override never
+# mixes with what was fetched from the real services.
+
+DEFAULTS = {
+    'weatherapi': 'http://api.weatherapi.com/v1',
+    'nasa': 'https://power.larc.nasa.gov/api',
+    'ambee': 'https://api.ambeedata.com',
+    'ipinfo': 'https://ipinfo.io',
+    'inference': 'https://models.inference.ai.azure.com',
+}
+
+
+def base_url(provider):
+    override = os.environ.get(f'{provider.upper()}_BASE_URL')
+    if override:
+        return override.rstrip('/')
+    stub = os.environ.get('FARMERS_AID_STUB_URL')
+    if stub:
+        return f"{stub.rstrip('/')}/{provider}"
+    return DEFAULTS[provider]
+
+
+# Directory to persist provider data in: path itself with the real services, otherwise a
+# subdirectory per set of overridden base URLs
+def storage_dir(path):
+    overridden = {provider: base_url(provider) for provider in DEFAULTS if base_url(provider) != DEFAULTS[provider]}
+    if not overridden:
+        return path
+    digest = hashlib.sha1(json.dumps(overridden, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+    return os.path.join(path, f'endpoints-{digest}')
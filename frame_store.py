@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+import pandas as pd
+
+from endpoints import storage_dir
+
+# Precomputed dashboard frames per location, written by ingest_worker.py and read by the
+# data layer, so a page load reads Parquet files instead of calling the providers.
+#
+#   data/locations.json                    locations the worker keeps up to date
+#   data/frames/<key>/<version>/*.parquet  one directory per ingestion run
+#   data/frames/<key>/current.json         the version readers should use (swapped atomically)
+#                                          and when it was written
+#   data/frames/<key>/status.json          the worker's last attempt, success, error, next run
+#
+# Locations registered by the dashboard carry when they were last viewed and are dropped,
+# frames and all, once nobody viewed them for REGISTRATION_TTL. Pinned ones (the farms given
+# to the worker with --farms) stay.
+
+DATA_DIR = storage_dir(os.environ.get('FARMERS_AID_DATA_DIR', 'data'))
+FRAMES_DIR = os.path.join(DATA_DIR, 'frames')
+REGISTRY_PATH = os.path.join(DATA_DIR, 'locations.json')
+
+FRAME_NAMES = ('pollen', 'real_time', 'weather')
+KEEP_VERSIONS = 2  # older versions are deleted, the previous one stays for readers mid-load
+REGISTRATION_TTL = 3 * 24 * 60 * 60  # seconds a dashboard location is kept without a view
+TOUCH_EVERY = 60 * 60  # a view updates last_seen at most this often per process
+
+_registry_lock = threading.Lock()
+_touched = {}  # key -> when this process last wrote its last_seen
+
+
+# Directory-safe key for a location: readable name plus a hash of everything that identifies it
+def location_key(location, place, latitude, longitude):
+    identity = json.dumps([location, place, round(float(latitude), 4), round(float(longitude), 4)])
+    slug = re.sub(r'[^a-z0-9]+', '-', str(location).lower()).strip('-') or 'location'
+    return f"{slug}-{hashlib.sha1(identity.encode('utf-8')).hexdigest()[:10]}"
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_json(path, value):
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp, path)
+
+
+# Locations the worker refreshes:
+# [{'key', 'location', 'place', 'latitude', 'longitude', 'last_seen', 'pinned'}]
+def registered():
+    return _read_json(REGISTRY_PATH) or []
+
+
+# Add a location for the worker to pick up (weather for location, pollen for place), or mark it
+# as viewed again; pinned=True keeps it registered until it is removed by hand. Returns its key.
+def register(location, place, latitude, longitude, pinned=False):
+    key = location_key(location, place, latitude, longitude)
+    now = time.time()
+    if not pinned and now - _touched.get(key, 0) < TOUCH_EVERY:
+        return key
+    with _registry_lock:
+        entries = registered()
+        entry = next((entry for entry in entries if entry['key'] == key), None)
+        if entry is None:
+            entry = {'key': key, 'location': location, 'place': place,
+                     'latitude': float(latitude), 'longitude': float(longitude)}
+            entries.append(entry)
+        entry['last_seen'] = now
+        entry['pinned'] = pinned or entry.get('pinned', False)
+        os.makedirs(DATA_DIR, exist_ok=True)
+        _write_json(REGISTRY_PATH, entries)
+        _touched[key] = now
+    return key
+
+
+# Drop the locations nobody viewed for REGISTRATION_TTL, with their frames; returns them
+def expire(now=None):
+    now = time.time() if now is None else now
+    with _registry_lock:
+        entries = registered()
+        expired = [entry for entry in entries
+                   if not entry.get('pinned') and now - entry.get('last_seen', 0) > REGISTRATION_TTL]
+        if not expired:
+            return []
+        _write_json(REGISTRY_PATH, [entry for entry in entries if entry not in expired])
+    for entry in expired:
+        shutil.rmtree(_frames_dir(entry['key']), ignore_errors=True)
+    return expired
+
+
+def _frames_dir(key):
+    return os.path.join(FRAMES_DIR, key)
+
+
+# Store one run's frames ({'pollen': df, 'real_time': df, 'weather': df}) and make them current
+def write_frames(key, frames):
+    updated_at = time.time()
+    version = f'{int(updated_at * 1000)}'
+    path = os.path.join(_frames_dir(key), version)
+    os.makedirs(path, exist_ok=True)
+    for name in FRAME_NAMES:
+        frames[name].to_parquet(os.path.join(path, f'{name}.parquet'), index=False)
+    _write_json(os.path.join(_frames_dir(key), 'current.json'),
+                {'version': version, 'updated_at': updated_at})
+
+    versions = sorted((entry for entry in os.listdir(_frames_dir(key)) if entry.isdigit()), key=int)
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(_frames_dir(key), old), ignore_errors=True)
+    return updated_at
+
+
+# {'version', 'updated_at'} of the frames readers should use, None before the first run
+def current(key):
+    return _read_json(os.path.join(_frames_dir(key), 'current.json'))
+
+
+# The current frames of a location as a dict of DataFrames, None if there are none
+def read_frames(key):
+    pointer = current(key)
+    if pointer is None:
+        return None
+    path = os.path.join(_frames_dir(key), pointer['version'])
+    try:
+        return {name: pd.read_parquet(os.path.join(path, f'{name}.parquet')) for name in FRAME_NAMES}
+    except (FileNotFoundError, OSError):
+        return None
+
+
+def read_status(key):
+    return _read_json(os.path.join(_frames_dir(key), 'status.json')) or {}
+
+
+def write_status(key, status):
+    os.makedirs(_frames_dir(key), exist_ok=True)
+    _write_json(os.path.join(_frames_dir(key), 'status.json'), status)
+
+
+# Ingestion health per registered location: lag since the last successful run and whether it
+# is within two of the worker's intervals
+def health(now=None):
+    now = time.time() if now is None else now
+    locations = []
+    for entry in registered():
+        status = read_status(entry['key'])
+        last_success = status.get('last_success')
+        lag = None if last_success is None else round(now - last_success, 1)
+        interval = status.get('interval')
+        locations.append({
+            'key': entry['key'],
+            'location': entry['location'],
+            'lag_s': lag,
+            'healthy': lag is not None and interval is not None and lag <= 2 * interval,
+            'consecutive_failures': status.get('consecutive_failures', 0),
+            'last_error': status.get('last_error'),
+            'next_run_in_s': None if status.get('next_run') is None else round(status['next_run'] - now, 1),
+        })
+    lags = [location['lag_s'] for location in locations if location['lag_s'] is not None]
+    return {
+        'healthy': bool(locations) and all(location['healthy'] for location in locations),
+        'locations': locations,
+        'max_lag_s': max(lags) if lags else None,
+    }
@@ -0,0 +1,122 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from nasa_grid import FILL_VALUE
+
+# Typed, columnar DataFrames built straight from the API JSON. Values are collected column by
+# column and converted once in build() according to a schema: dates become datetime64, text
+# that repeats on every row (location, country, condition) becomes categorical and measures
+# become float32. Multi-farm, multi-year frames stay several times smaller than with object
+# columns, and sources are joined on real dates instead of date strings.
+
+DATE = 'date'
+DATETIME = 'datetime'
+CATEGORY = 'category'
+FLOAT32 = 'float32'
+
+# Column -> type of the weather DataFrames (the column order is the frame's column order)
+WEATHER_SCHEMA = {
+    'Date': DATE,
+    'Location': CATEGORY,
+    'Country': CATEGORY,
+    'Local Time': DATETIME,
+    'Avg Temperature (°C)': FLOAT32,
+    'Avg Humidity (%)': FLOAT32,
+    'Total Precipitation (mm)': FLOAT32,
+    'Condition': CATEGORY,
+}
+
+# Where the measures are in a WeatherAPI forecastday 'day' block and in a 'current' block
+DAY_FIELDS = {'Avg Temperature (°C)': 'avgtemp_c', 'Avg Humidity (%)': 'avghumidity',
+              'Total Precipitation (mm)': 'totalprecip_mm'}
+CURRENT_FIELDS = {'Avg Temperature (°C)': 'temp_c', 'Avg Humidity (%)': 'humidity',
+                  'Total Precipitation (mm)': 'precip_mm'}
+
+
+# Codes into a list of distinct values, in order of first appearance
+def _factorize(values):
+    index = {}
+    codes = np.array([index.setdefault(value, len(index)) for value in values], dtype=np.int32)
+    return codes, list(index)
+
+
+def _parse_time(value, fmt):
+    try:
+        return np.datetime64(datetime.strptime(value, fmt), 'us')
+    except (TypeError, ValueError):
+        return np.datetime64('NaT', 'us')
+
+
+# Text and dates repeat a lot (one location, a few days), so only distinct values are converted
+def _typed(values, kind):
+    if kind in (DATE, DATETIME):
+        codes, uniques = _factorize(values)
+        fmt = '%Y-%m-%d' if kind == DATE else '%Y-%m-%d %H:%M'
+        parsed = np.array([_parse_time(value, fmt) for value in uniques], dtype='datetime64[us]')
+        return parsed[codes]
+    if kind == CATEGORY:
+        codes, uniques = _factorize(values)
+        missing = [i for i, value in enumerate(uniques) if value is None]
+        if missing:
+            codes[codes == missing[0]] = -1
+            codes[codes > missing[0]] -= 1
+            uniques.pop(missing[0])
+        return pd.Categorical.from_codes(codes, categories=pd.Index(uniques, dtype=object))
+    if kind == FLOAT32:
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float32)
+    return values
+
+
+class FrameBuilder:
+    def __init__(self, schema):
+        self.schema = schema
+        self._columns = {name: [] for name in schema}
+
+    def __len__(self):
+        return len(next(iter(self._columns.values()), []))
+
+    # Add one row; columns missing from values are left empty (NaN / NaT)
+    def append(self, values):
+        for name, column in self._columns.items():
+            column.append(values.get(name))
+
+    def build(self):
+        return pd.DataFrame({name: _typed(self._columns[name], kind) for name, kind in self.schema.items()},
+                            columns=list(self.schema))
+
+
+def _location_values(data):
+    location = data['location']
+    return {'Location': location['name'], 'Country': location['country'], 'Local Time': location['localtime']}
+
+
+# Add the 'current' block of a WeatherAPI response as the row for date (YYYY-MM-DD)
+def add_current_weather(builder, data, date):
+    current = data['current']
+    values = _location_values(data)
+    values['Date'] = date
+    values['Condition'] = current['condition']['text']
+    for column, field in CURRENT_FIELDS.items():
+        values[column] = current[field]
+    builder.append(values)
+
+
+# Add daily records: (date, WeatherAPI response, one of its forecastday 'day' blocks)
+def add_weather_days(builder, records):
+    for date, data, day in records:
+        values = _location_values(data)
+        values['Date'] = date
+        values['Condition'] = day['condition']['text']
+        for column, field in DAY_FIELDS.items():
+            values[column] = day[field]
+        builder.append(values)
+
+
+# {YYYYMMDD: value} from NASA POWER as a float32 Series on a DatetimeIndex, fill values as NaN
+def daily_series(values, name):
+    index = pd.DatetimeIndex(np.array([_parse_time(day, '%Y%m%d') for day in values], dtype='datetime64[us]'))
+    data = np.array(list(values.values()), dtype=np.float32)
+    data[data == FILL_VALUE] = np.nan
+    return pd.Series(data, index=index, name=name)
@@ -0,0 +1,239 @@
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import circuit_breaker
+import metrics
+import rate_limit
+
+# Shared HTTP layer for every upstream provider. Each provider gets one long-lived
+# requests.Session, so connections (and TLS handshakes) are reused between calls, one
+# circuit breaker (see circuit_breaker.py), so a failing provider is skipped instead of awaited,
+# and a rate limit and daily quota (see rate_limit.py). Identical GETs that are in flight at the
+# same time (e.g. two sessions loading the same place) share one upstream call.
+
+# Per-provider settings: (connect timeout, read timeout) in seconds and retry count
+PROVIDERS = {
+    'weatherapi': {'timeout': (3.05, 10), 'retries': 3},
+    'ambee': {'timeout': (3.05, 10), 'retries': 3},
+    'nasa': {'timeout': (3.05, 30), 'retries': 2},
+    'ipinfo': {'timeout': (2, 5), 'retries': 1},
+    # Completions are POSTs, which are never retried here; the Azure SDK has its own retry policy
+    'inference': {'timeout': (3.05, 120), 'retries': 0},
+}
+DEFAULT_PROVIDER = {'timeout': (3.05, 10), 'retries': 2}
+
+# Connections kept open per host, enough for the concurrent history fan-out (grown to a
+# provider's in-flight cap when one is set, see set_max_in_flight)
+POOL_SIZE = 10
+
+# Responses worth retrying: rate limited or server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Optional cap on concurrent requests per provider, see set_max_in_flight
+_limits = {}
+_pool_sizes = {}
+
+# Requests in flight by (provider, url, params, headers), for coalescing identical ones
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+# urllib3 Retry that charges every retry to the provider's daily quota when it is made, so
+# retries are counted also when the request ends in an exception
+class _QuotaRetry(Retry):
+    def __init__(self, *args, provider=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.provider = provider
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.provider = self.provider
+        return retry
+
+    def increment(self, *args, **kwargs):
+        retry = super().increment(*args, **kwargs)  # raises MaxRetryError when none are left
+        rate_limit.record_extra(self.provider, 1)
+        return retry
+
+
+def _build_session(provider):
+    settings = PROVIDERS.get(provider, DEFAULT_PROVIDER)
+    retry = _QuotaRetry(
+        provider=provider,
+        total=settings['retries'],
+        backoff_factor=0.5,  # 0.5s, 1s, 2s, ...
+        backoff_jitter=0.25,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    pool_size = _pool_sizes.get(provider, POOL_SIZE)
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Get (or create) the shared session for a provider
+def get_session(provider):
+    with _sessions_lock:
+        if provider not in _sessions:
+            _sessions[provider] = _build_session(provider)
+        return _sessions[provider]
+
+
+# Limit how many requests to a provider can be in flight at once (None removes the limit).
+# Used by batch runs so hundreds of farms don't flood a single API. The provider's connection
+# pool is sized to the limit, so every request in flight can keep its connection for reuse
+# (a smaller pool discards the extra connections and opens new ones on the next calls).
+def set_max_in_flight(provider, limit):
+    with _sessions_lock:
+        if limit is None:
+            _limits.pop(provider, None)
+        else:
+            _limits[provider] = threading.BoundedSemaphore(limit)
+        pool_size = max(POOL_SIZE, limit or 0)
+        old = None
+        if _pool_sizes.get(provider, POOL_SIZE) != pool_size:
+            _pool_sizes[provider] = pool_size
+            # Rebuilt with the new size on next use
+            old = _sessions.pop(provider, None)
+    # Closing drops the idle connections; requests in flight on it finish and close theirs
+    if old is not None:
+        old.close()
+
+
+def _flight_key(provider, url, params, headers):
+    return provider, url, json.dumps([params, headers], sort_keys=True, default=str)
+
+
+# GET a URL through the provider's pooled session with its timeouts and retries.
+# Raises circuit_breaker.CircuitOpen without calling out while the provider's breaker is open,
+# and rate_limit.QuotaExceeded when the provider's rate or daily quota is used up. A GET that
+# is identical to one already in flight waits for that one and gets the same response.
+def get(provider, url, params=None, headers=None, timeout=None):
+    key = _flight_key(provider, url, params, headers)
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        metrics.increment('http_coalesced_total', provider=provider)
+        with metrics.span('http', provider=provider, coalesced=True):
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.response
+
+    try:
+        flight.response = _get(provider, url, params, headers, timeout)
+        return flight.response
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def _get(provider, url, params, headers, timeout):
+    settings = PROVIDERS.get(provider, DEFAULT_PROVIDER)
+    session = get_session(provider)
+    limit = _limits.get(provider)
+    breaker = circuit_breaker.breaker(provider)
+    # The quota first: a rejection after allow() would leave a half-open breaker's probe claimed
+    rate_limit.acquire(provider)
+    try:
+        breaker.allow()
+    except circuit_breaker.CircuitOpen:
+        rate_limit.release(provider)
+        raise
+    with metrics.span('http', provider=provider) as span:
+        if limit is not None:
+            limit.acquire()
+        start = time.perf_counter()
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=timeout or settings['timeout'])
+        except requests.RequestException:
+            metrics.increment('http_errors_total', provider=provider)
+            breaker.record_failure()
+            raise
+        finally:
+            if limit is not None:
+                limit.release()
+            metrics.observe('http_request_seconds', time.perf_counter() - start, provider=provider)
+
+        retries = _retries(response)
+        span.set(http_status=response.status_code, bytes=len(response.content), retries=retries)
+        if response.status_code >= 400:
+            span.status = 'error'
+        # A 404 for an unknown place is the caller's problem, not the provider's
+        if response.status_code in RETRY_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+    metrics.increment('http_requests_total', provider=provider, status=response.status_code)
+    _record_pool_stats(provider)
+    return response
+
+
+# Retries urllib3 made before this response arrived
+def _retries(response):
+    retries = getattr(response.raw, 'retries', None)
+    return len(retries.history) if retries is not None else 0
+
+
+# Connection pool usage per host: requests sent vs. new connections opened
+def pool_stats(provider=None):
+    stats = {}
+    with _sessions_lock:
+        sessions = dict(_sessions) if provider is None else {provider: _sessions.get(provider)}
+    for name, session in sessions.items():
+        if session is None:
+            continue
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stats[f'{name}:{pool.host}'] = {
+                    'requests': pool.num_requests,
+                    'connections': pool.num_connections,
+                    'reused': max(pool.num_requests - pool.num_connections, 0),
+                }
+    return stats
+
+
+def _record_pool_stats(provider):
+    for host, stat in pool_stats(provider).items():
+        metrics.set_gauge('http_pool_connections', stat['connections'], host=host)
+        metrics.set_gauge('http_pool_reused', stat['reused'], host=host)
+
+
+# Close every pooled connection, e.g. at shutdown
+def close_all():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
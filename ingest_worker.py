@@ -0,0 +1,131 @@
+import argparse
+import json
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frame_store
+import metrics
+import snapshots
+from batch import read_farms
+from pollen import get_combined_pollen_data
+from weather import get_combined_weather_data
+
+# Background ingestion, so dashboard page loads only read precomputed frames:
+#
+#   python ingest_worker.py                      # keep every registered location fresh
+#   python ingest_worker.py --farms farms.csv    # also register the farms of a batch CSV
+#   python ingest_worker.py --once               # one pass over what is due, then exit
+#   python ingest_worker.py --report             # health and lag as JSON (exit 1 if unhealthy)
+#
+# Locations are registered in data/locations.json, by --farms (kept for good) or by the
+# dashboard when it shows one (dropped after frame_store.REGISTRATION_TTL without a view, so
+# places looked at once don't use up the providers' quotas forever). Each location is
+# refreshed every --interval seconds, give or take --jitter of it so locations don't all hit
+# the providers at once. A failed run is retried with a doubling backoff. When and how each
+# run went is kept in the location's status file, so after downtime whatever is overdue runs
+# straight away (pollen also fills the missed hours, see pollen.refresh_pollen). The worker
+# fetches what is due itself (see snapshots.synchronous); when a provider fails and only stale
+# data is left, the run fails and the last good frames stay current.
+
+DEFAULT_INTERVAL = 15 * 60  # seconds
+DEFAULT_JITTER = 0.1  # fraction of the interval
+RETRY_BACKOFF = 60  # seconds after the first failure, doubled per failure up to the interval
+TICK = 5  # seconds between checks for due (and newly registered) locations
+
+
+def _next_run(now, interval, jitter):
+    return now + interval * (1 + random.uniform(-jitter, jitter))
+
+
+# Fetch and store the frames of one location, returns its new status
+def ingest_location(entry, interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER):
+    status = frame_store.read_status(entry['key'])
+    start = time.time()
+    status.update(last_attempt=start, interval=interval)
+    try:
+        with metrics.span('ingest', location=entry['location']), snapshots.synchronous(), \
+                snapshots.track() as stale:
+            pollen_df = get_combined_pollen_data(entry['place'])
+            real_df, weather_df = get_combined_weather_data(entry['location'], entry['latitude'],
+                                                            entry['longitude'])
+        # Keep the last good frames rather than replace them with nothing or old data
+        if weather_df.empty:
+            raise RuntimeError('no weather data')
+        if stale:
+            raise RuntimeError(f"stale data from {', '.join(sorted(stale))}")
+        frame_store.write_frames(entry['key'], {'pollen': pollen_df, 'real_time': real_df, 'weather': weather_df})
+    except Exception as e:
+        failures = status.get('consecutive_failures', 0) + 1
+        status.update(consecutive_failures=failures, last_error=f'{type(e).__name__}: {e}',
+                      next_run=time.time() + min(RETRY_BACKOFF * 2 ** (failures - 1), interval))
+        metrics.increment('ingest_runs_total', result='error')
+    else:
+        status.update(last_success=time.time(), consecutive_failures=0, last_error=None,
+                      next_run=_next_run(start, interval, jitter))
+        metrics.increment('ingest_runs_total', result='ok')
+    status['duration_s'] = round(time.time() - start, 3)
+    frame_store.write_status(entry['key'], status)
+    if status.get('last_success') is not None:
+        metrics.set_gauge('ingest_lag_seconds', time.time() - status['last_success'], location=entry['key'])
+    return status
+
+
+# Registered locations whose next run is due (never run counts as due)
+def due_locations(now=None):
+    now = time.time() if now is None else now
+    return [entry for entry in frame_store.registered()
+            if frame_store.read_status(entry['key']).get('next_run', 0) <= now]
+
+
+# Run what is due, forever or (once=True) a single pass. metrics_file gets the Prometheus text
+# after every pass.
+def run(interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER, workers=4, once=False, metrics_file=None):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            for entry in frame_store.expire():
+                print(f"{entry['location']} ({entry['key']}): not viewed for a while, dropped", flush=True)
+            due = due_locations()
+            if due:
+                for entry, status in zip(due, pool.map(lambda entry: ingest_location(entry, interval, jitter), due)):
+                    outcome = 'ok' if status['consecutive_failures'] == 0 else status['last_error']
+                    print(f"{entry['location']} ({entry['key']}): {outcome} in {status['duration_s']}s", flush=True)
+                if metrics_file:
+                    metrics.write_prometheus(metrics_file)
+            if once:
+                return
+            time.sleep(TICK)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep precomputed dashboard frames fresh for registered locations")
+    parser.add_argument('--farms', help="register the farms of a CSV (name, location, latitude, longitude)")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help="seconds between refreshes")
+    parser.add_argument('--jitter', type=float, default=DEFAULT_JITTER,
+                        help="random spread of the interval, as a fraction of it")
+    parser.add_argument('--workers', type=int, default=4, help="locations refreshed at the same time")
+    parser.add_argument('--once', action='store_true', help="run what is due once and exit")
+    parser.add_argument('--metrics-file', help="write Prometheus metrics to this file after every pass")
+    parser.add_argument('--report', action='store_true', help="print the health and lag report and exit")
+    args = parser.parse_args(argv)
+
+    if args.report:
+        report = frame_store.health()
+        print(json.dumps(report, indent=2))
+        return 0 if report['healthy'] else 1
+
+    if args.farms:
+        for farm in read_farms(args.farms):
+            frame_store.register(farm['location'], farm['location'], farm['latitude'], farm['longitude'],
+                                 pinned=True)
+
+    overdue = due_locations()
+    if overdue:
+        print(f"{len(overdue)} of {len(frame_store.registered())} locations due, catching up", flush=True)
+    run(args.interval, args.jitter, args.workers, args.once, args.metrics_file)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from azure.ai.inference import ChatCompletionsClient
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
+
+import http_client
+import metrics
+
+# Process-wide pool of ChatCompletionsClient objects. Clients are reused per endpoint and
+# credential and all of them send through one pooled transport, so connections to the
+# inference endpoint stay open between completions. A semaphore caps the number of
+# completions in flight; callers queue for a free slot and give up after QUEUE_TIMEOUT.
+
+MAX_IN_FLIGHT = 4
+QUEUE_TIMEOUT = 30  # seconds
+
+
+class CompletionQueueTimeout(TimeoutError):
+    pass
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_transport = None
+_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def _shared_transport():
+    global _transport
+    if _transport is None:
+        connect_timeout, read_timeout = http_client.PROVIDERS['inference']['timeout']
+        _transport = RequestsTransport(session=http_client.get_session('inference'), session_owner=False,
+                                       connection_timeout=connect_timeout, read_timeout=read_timeout)
+    return _transport
+
+
+# Return the shared client for this endpoint and key, creating it on first use
+def get_client(auth_token, endpoint):
+    # Only a hash of the key is kept in the registry
+    key = (endpoint, hashlib.sha256(auth_token.encode('utf-8')).hexdigest())
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = ChatCompletionsClient(
+                endpoint=endpoint,
+                credential=AzureKeyCredential(auth_token),
+                transport=_shared_transport(),
+            )
+        return client
+
+
+def _set_in_flight(delta):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += delta
+        metrics.set_gauge('llm_in_flight', _in_flight)
+
+
+# Hold one of the MAX_IN_FLIGHT completion slots for the duration of the block.
+# Raises CompletionQueueTimeout if no slot frees up within timeout seconds.
+@contextmanager
+def completion_slot(model, timeout=QUEUE_TIMEOUT):
+    queued = time.perf_counter()
+    if not _slots.acquire(timeout=timeout):
+        metrics.increment('llm_queue_timeouts_total', model=model)
+        raise CompletionQueueTimeout(f"No free completion slot after {timeout}s")
+    start = time.perf_counter()
+    metrics.observe('llm_queue_wait_seconds', start - queued, model=model)
+    _set_in_flight(1)
+    try:
+        yield
+    finally:
+        _set_in_flight(-1)
+        _slots.release()
+        metrics.observe('llm_completion_seconds', time.perf_counter() - start, model=model)
@@ -1,12 +1,17 @@
 import streamlit as st
 import pandas as pd
-import requests
+import http_client
+from endpoints import base_url
 import pycountry
-import plotly.express as px
-import plotly.graph_objects as go
-from pollen import get_combined_pollen_data
-from weather import get_combined_weather_data
-from AI import get_agricultural_response, get_agricultural_chat
+from AI import stream_agricultural_chat, iter_sections
+import report_jobs
+import charts
+import circuit_breaker
+import climatology
+import data_layer
+import downsample
+import frame_store
+import metrics
 import datetime as dt
 
 # Load the IP API key from the .env file
@@ -22,246 +27,351 @@ def get_country_name(country_code):
         return 'Unknown'
 
 # Function to get user's location data from ipinfo.io using the API key
+# (failures raise, so they are not cached for the whole day)
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def fetch_ip_info():
+    response = http_client.get('ipinfo', base_url('ipinfo'), params={"token": IPkey})
+    response.raise_for_status()
+    data = response.json()
+    location = data.get('loc', '').split(',')
+    city = data.get('city', 'Unknown')
+    country_code = data.get('country', 'Unknown')
+    country_name = get_country_name(country_code)
+    return {
+        "city": city,
+        "country": country_name,
+        "latitude": location[0] if location else 'Unknown',
+        "longitude": location[1] if location else 'Unknown'
+    }
+
 def get_ip_info():
     try:
-        response = requests.get(f"https://ipinfo.io?token={IPkey}")
-        data = response.json()
-        location = data.get('loc', '').split(',')
-        city = data.get('city', 'Unknown')
-        country_code = data.get('country', 'Unknown')
-        country_name = get_country_name(country_code)
-        return {
-            "city": city,
-            "country": country_name,
-            "latitude": location[0] if location else 'Unknown',
-            "longitude": location[1] if location else 'Unknown'
-        }
+        return fetch_ip_info()
     except Exception as e:
         return {"error": str(e)}
 
-# Get and display the location data
-location_data = get_ip_info()
-
-# Variables for each location data
-city = "Manama"
-country = "Bahrain"
-latitude = 26.169422
-longitude = 50.552246
-
-# Create a variable with the format City,Country
-place = f"Isatown,{country}"
-
-# Fetch data
-pollen_df = get_combined_pollen_data(place)
-real_df, weather_df = get_combined_weather_data(city, latitude, longitude)
-
-# App start from here
-dashb, about, faq = st.tabs(["Dashboard 📊", "About Us ℹ️", "FAQ 🔍"])
-
-# Dashboard tab
-with dashb:
-    At = st.expander("Advance Tweaks", expanded=False)
-    chrt, rprt, dyrt, cstm = st.tabs(["📈 Charts", "🗒️ Report", "📊 Dynamic Report", "Custom Statistics 🤖"])
-
-    with At:
-        st.write("Use the options below to tweak chart settings:")
-        chart_color = st.color_picker("Select Chart Line Color", "#dad6c9")
-        line_style = st.selectbox("Select Line Style", ['solid', 'dot', 'dash'])
-        y_axis_range_temp = st.slider("Select Y-axis range for Temperature (°C)", 0, 50, (10, 40))
-        y_axis_range_humidity = st.slider("Select Y-axis range for Humidity (%)", 0, 100, (20, 80))
-        show_grid = st.checkbox("Show Grid", value=True)
-
-    with chrt:
-        col1, col2 = st.columns([4, 6])
-
-        # First chart: Line plot for weed pollen count
-        with col1:
-            pollen_df['time'] = pd.to_datetime(pollen_df['time'], unit='s')
-            fig1 = px.line(pollen_df, x='time', y='Count.weed_pollen',
-                           labels={'Count.weed_pollen': 'Weed Pollen Count', 'time': 'Time'},
-                           title="Weed Pollen Counts Over Time",
-                           line_shape="linear")
-            fig1.update_traces(line=dict(color=chart_color))
-            st.plotly_chart(fig1, use_container_width=True, key="weed_pollen_chart")
-
-        # Second chart: Temperature and humidity trends with customization
-        with col2:
-            fig2 = go.Figure()
-            fig2.add_trace(go.Scatter(
-                x=weather_df['Date'], y=weather_df['Avg Temperature (°C)'],
-                mode='lines',
-                line=dict(dash=line_style, color='#A3AB30'),
-                hovertemplate='Temperature: %{y:.2f} °C<br>Date: %{x}<extra></extra>',
-                yaxis='y1'
-            ))
-            fig2.add_trace(go.Scatter(
-                x=weather_df['Date'], y=weather_df['Avg Humidity (%)'],
-                mode='lines',
-                line=dict(dash=line_style, color=chart_color),
-                hovertemplate='Humidity: %{y:.2f} %<br>Date: %{x}<extra></extra>',
-                yaxis='y2'
-            ))
-
-            fig2.update_layout(
-                title="",
-                xaxis_title="",
-                yaxis=dict(title="", range=y_axis_range_temp,
-                           titlefont=dict(color=chart_color), tickfont=dict(color=chart_color)),
-                yaxis2=dict(title="", range=y_axis_range_humidity,
-                            titlefont=dict(color=chart_color), tickfont=dict(color=chart_color),
-                            overlaying='y', side='right'),
-                showlegend=False,
-                xaxis_showgrid=show_grid,
-                yaxis_showgrid=show_grid
-            )
-            st.plotly_chart(fig2, use_container_width=True, key="temp_humidity_chart")
-
-        # Display metrics for Avg Temperature, Avg Humidity, and Total Precipitation
-        col3, col4 = st.columns([4, 2])
-
-        with col4:
-            avg_temp = real_df['Avg Temperature (°C)'].mean()
-            avg_humidity = real_df['Avg Humidity (%)'].mean()
-            total_precipitation = real_df['Total Precipitation (mm)'].sum()
-
-            st.metric(label="Current Temperature (°C)", value=f"{avg_temp:.2f} °C")
-            st.metric(label="Current Humidity (%)", value=f"{avg_humidity:.2f} %")
-            st.metric(label="Current Precipitation (mm)", value=f"{total_precipitation:.2f} mm")
-
-        # Correlation heatmap
-        with col3:
-            combined_df = pollen_df[['Count.weed_pollen']].join(
-                weather_df[['Avg Temperature (°C)', 'Avg Humidity (%)']]
-            )
-            corr_matrix = combined_df.corr()
-            fig4 = go.Figure(data=go.Heatmap(
-                z=corr_matrix.values,
-                x=corr_matrix.columns,
-                y=corr_matrix.columns,
-                colorscale='Viridis'
-            ))
-            fig4.update_layout(
-                title='Correlation Heatmap',
-                xaxis_title='Variables',
-                yaxis_title='',
-                yaxis=dict(showticklabels=False)
-            )
-            st.plotly_chart(fig4, use_container_width=True, key="correlation_heatmap")
-
-    with rprt:
-        full_report = get_agricultural_response(Ai_key, weather_df, pollen_df, temperature=0.3, max_tokens=4096, top_p=0.9)
-        report_sections = full_report.split('---')
+# Provider names for the stale data notice
+PROVIDER_NAMES = {'weatherapi': 'WeatherAPI', 'nasa': 'NASA POWER', 'ambee': 'Ambee pollen'}
+
+# 95 -> "2 min", 7200 -> "2 h"
+def format_age(seconds):
+    if seconds < 2 * 60 * 60:
+        return f"{max(round(seconds / 60), 1)} min"
+    if seconds < 2 * 24 * 60 * 60:
+        return f"{round(seconds / 3600)} h"
+    return f"{round(seconds / 86400)} days"
+
+# A slider to pick part of a long series, which is then drawn at full resolution (charts
+# downsample anything longer than downsample.MAX_POINTS). Short series are returned as they are.
+def zoom_window(df, column, label, key):
+    if len(df) <= downsample.MAX_POINTS:
+        return df
+    first, last = df[column].min().to_pydatetime(), df[column].max().to_pydatetime()
+    if first >= last:
+        return df
+    start, end = st.slider(label, min_value=first, max_value=last, value=(first, last), key=key)
+    return downsample.window(df, column, start, end)
+
+# Button callback for the report tabs
+def request_report():
+    st.session_state.report_requested = True
+
+# Spans of one render, for the debug panel: one row per span, indented under its parent
+def show_debug_panel(trace_id):
+    records = metrics.spans(trace_id)
+    by_id = {record['span_id']: record for record in records}
+
+    def depth(record):
+        level = 0
+        while record['parent_id'] in by_id:
+            record = by_id[record['parent_id']]
+            level += 1
+        return level
+
+    rows = []
+    for record in sorted(records, key=lambda r: r['started_at']):
+        rows.append({
+            'Span': '\u2003' * depth(record) + record['name'],
+            'Target': record.get('provider') or record.get('model') or record.get('function') or '',
+            'ms': round(record['duration_s'] * 1000, 1),
+            'Status': record['status'] if record['error'] is None else record['error'],
+            'HTTP': record.get('http_status'),
+            'Bytes': record.get('bytes'),
+            'Retries': record.get('retries'),
+            'Tokens': record.get('prompt_tokens'),
+        })
+    st.caption("Cached data doesn't call the providers, so a fast rerun shows few spans.")
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    col1, col2 = st.columns(2)
+    col1.download_button("Metrics (Prometheus)", metrics.prometheus_text(), file_name="farmers-aid.prom")
+    col2.download_button("Spans (JSON lines)", metrics.spans_jsonl(), file_name="farmers-aid-spans.jsonl")
+
+    # Lag of the ingestion worker's frames (see ingest_worker.py)
+    ingestion = frame_store.health()
+    if ingestion['locations']:
+        st.caption("Ingestion worker: " + ("healthy" if ingestion['healthy'] else "behind or not running"))
+        st.dataframe(pd.DataFrame(ingestion['locations']), use_container_width=True, hide_index=True)
+
+# Everything this run does is traced under one render span. Streamlit reuses the script
+# thread for a rerun, so the span is always deactivated and ended, also when the run is
+# stopped or restarted halfway.
+render_span = metrics.start_span('render')
+render_token = metrics.activate(render_span)
+try:
+    # Get and display the location data
+    location_data = get_ip_info()
+
+    # Variables for each location data
+    city = "Manama"
+    country = "Bahrain"
+    latitude = 26.169422
+    longitude = 50.552246
+
+    # Create a variable with the format City,Country
+    place = f"Isatown,{country}"
+
+    # App start from here
+    dashb, about, faq = st.tabs(["Dashboard 📊", "About Us ℹ️", "FAQ 🔍"])
+
+    # Dashboard tab
+    with dashb:
+        At = st.expander("Advance Tweaks", expanded=False)
+
+        with At:
+            st.write("Use the options below to tweak chart settings:")
+            chart_color = st.color_picker("Select Chart Line Color", "#dad6c9")
+            line_style = st.selectbox("Select Line Style", ['solid', 'dot', 'dash'])
+            y_axis_range_temp = st.slider("Select Y-axis range for Temperature (°C)", 0, 50, (10, 40))
+            y_axis_range_humidity = st.slider("Select Y-axis range for Humidity (%)", 0, 100, (20, 80))
+            show_grid = st.checkbox("Show Grid", value=True)
+            prefetch_report = st.checkbox("Prepare the report in the background", value=False)
+            show_debug = st.checkbox("Show timing details", value=False)
+
+            # Data is cached between reruns, this forces a fresh fetch. A report already asked for
+            # is regenerated only if the data changed (reports are cached by their data, see AI.py)
+            refresh_data = st.button("🔄 Refresh data")
+            if refresh_data:
+                data_layer.refresh()
+
+        # Fetch data (served from the data layer cache unless it expired or was refreshed)
+        # (a background refresh of a stale snapshot bumps the generation, which reloads the frames)
+        pollen_df, real_df, weather_df, late, stale = data_layer.load_dashboard_data(place, city, latitude, longitude,
+                                                                                    refresh=refresh_data)
+
+        # Say so when a provider is down and the frames were built from its last known data
+        if stale:
+            now = dt.datetime.now().timestamp()
+            st.warning("Showing the last available data for " + ", ".join(
+                f"{PROVIDER_NAMES.get(provider, provider)} (from {format_age(now - fetched_at)} ago)"
+                for provider, fetched_at in sorted(stale.items())) + ". Newer data will show up once it has been fetched.")
+
+        # ... and when a provider was too slow for this render or is paused after repeated failures
+        unavailable = sorted((late | set(circuit_breaker.open_providers())) - set(stale) - {'ipinfo'})
+        if unavailable:
+            st.caption("Not responding right now: " + ", ".join(PROVIDER_NAMES.get(provider, provider)
+                                                                 for provider in unavailable)
+                       + ". Their data will show up on a later refresh.")
+
+        # How today compares with the stored NASA POWER history (None until nasa_ingest has run),
+        # from today's daily record: weather_df without the real-time row
+        climate_df = climatology.assess_weather(latitude, longitude, weather_df.iloc[len(real_df):])
+
+        chrt, rprt, dyrt, cstm = st.tabs(["📈 Charts", "🗒️ Report", "📊 Dynamic Report", "Custom Statistics 🤖"])
+
+        with chrt:
+            col1, col2 = st.columns([4, 6])
+
+            # First chart: Line plot for weed pollen count
+            with col1:
+                if pollen_df.empty:
+                    fig1 = None
+                    st.info("Pollen data is not available right now.")
+                else:
+                    pollen_df['time'] = pd.to_datetime(pollen_df['time'], unit='s')
+                    pollen_view = zoom_window(pollen_df, 'time', "Pollen time window", key="pollen_window")
+                    fig1 = charts.cached(charts.weed_pollen_figure, pollen_view, chart_color)
+                    st.plotly_chart(fig1, use_container_width=True, key="weed_pollen_chart")
+
+            # Second chart: Temperature and humidity trends with customization
+            with col2:
+                weather_view = zoom_window(weather_df, 'Date', "Weather time window", key="weather_window")
+                fig2 = charts.cached(charts.temperature_humidity_figure, weather_view, chart_color, line_style,
+                                     y_axis_range_temp, y_axis_range_humidity, show_grid)
+                st.plotly_chart(fig2, use_container_width=True, key="temp_humidity_chart")
+
+            # Display metrics for Avg Temperature, Avg Humidity, and Total Precipitation
+            col3, col4 = st.columns([4, 2])
+
+            with col4:
+                avg_temp = real_df['Avg Temperature (°C)'].mean()
+                avg_humidity = real_df['Avg Humidity (%)'].mean()
+                total_precipitation = real_df['Total Precipitation (mm)'].sum()
+
+                # Show the anomaly against the day-of-year normal when we have history for this location
+                climate = {} if climate_df is None else climate_df.set_index('Measure').to_dict('index')
+
+                def climate_delta(measure):
+                    row = climate.get(measure)
+                    return None if row is None else f"{row['Anomaly']:+.2f} today vs normal"
+
+                def climate_help(measure):
+                    row = climate.get(measure)
+                    return None if row is None else row['Summary']
+
+                st.metric(label="Current Temperature (°C)", value=f"{avg_temp:.2f} °C",
+                          delta=climate_delta('Avg Temperature (°C)'), help=climate_help('Avg Temperature (°C)'))
+                st.metric(label="Current Humidity (%)", value=f"{avg_humidity:.2f} %",
+                          delta=climate_delta('Avg Humidity (%)'), help=climate_help('Avg Humidity (%)'))
+                st.metric(label="Current Precipitation (mm)", value=f"{total_precipitation:.2f} mm")
+
+            # Correlation heatmap
+            with col3:
+                if not pollen_df.empty:
+                    fig4 = charts.cached(charts.correlation_heatmap, pollen_df, weather_df, place)
+                    st.plotly_chart(fig4, use_container_width=True, key="correlation_heatmap")
+
+        with cstm:
+            st.header("Custom Statistics")
+
+            user_input = st.chat_input(f"Ask about agriculture in {place}:")
+
+            if user_input:
+                chat_stream = stream_agricultural_chat(Ai_key, user_input, place, weather_df, pollen_df, temperature=0.3, max_tokens=4096, top_p=0.9,
+                                                       climate_df=climate_df)
+                for j, chapter in enumerate(iter_sections(chat_stream, name='chat')):
+                    st.markdown(chapter)
+                    if j == 0 and fig1 is not None:
+                        st.plotly_chart(fig1, use_container_width=True, key="custom_weed_pollen_chart")
+                    elif j == 1:
+                        st.plotly_chart(fig2, use_container_width=True, key="custom_temp_humidity_chart")
+
+        # The report is only generated once one of the report tabs asks for it
+        report_requested = st.session_state.get('report_requested', False)
+
         date = dt.date.today().strftime("%d %m, %Y")
-        st.title(f"Comprehensive Agriculture Report: {place} ({date})")
-        for chapter in report_sections:
-            st.markdown(chapter)
-
-    with dyrt:
-        st.title(f"Dynamic Agriculture Report: {place} ({date})")
-        for i, chapter in enumerate(report_sections):
-            st.markdown(chapter)
-
-            # Insert charts between chapters at specific points
-            if i == 0:
-                st.plotly_chart(fig2, use_container_width=True, key="dynamic_temp_humidity_chart")
-            elif i == 1:
-                st.plotly_chart(fig1, use_container_width=True, key="dynamic_weed_pollen_chart")
-
-            # Insert horizontally stacked current data metrics in a box
-            if i == 2:
-                with st.container():
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric(label="Current Temperature (°C)", value=f"{avg_temp:.2f} °C")
-                    with col2:
-                        st.metric(label="Current Humidity (%)", value=f"{avg_humidity:.2f} %")
-                    with col3:
-                        st.metric(label="Current Precipitation (mm)", value=f"{total_precipitation:.2f} mm")
-
-    with cstm:
-        st.header("Custom Statistics")
-
-        user_input = st.chat_input(f"Ask about agriculture in {place}:")
-
-        if user_input:
-            ai_response = get_agricultural_chat(Ai_key, user_input, place, weather_df, pollen_df, temperature=0.3, max_tokens=4096, top_p=0.9)
-            custom_report = ai_response.split('---')
-            for j, chapter in enumerate(custom_report):
-                st.markdown(chapter)
-                if j == 0:
-                    st.plotly_chart(fig1, use_container_width=True, key="custom_weed_pollen_chart")
-                elif j == 1:
-                    st.plotly_chart(fig2, use_container_width=True, key="custom_temp_humidity_chart")
-
-# About Us tab
-with about:
-    st.title("About Us")
-
-    st.header("Project Overview")
-    st.write(
-        """
-        Welcome to **Farmers Aid**! Our project is dedicated to helping farmers make data-driven decisions through real-time data analytics collected from NASA and public APIs. We strive to empower farmers with the insights they need to optimize their practices and improve yields.
-        """
-    )
-
-    st.header("Meet Our Team")
-    team_members = {
-        "Mohammed Aldaqaq": "Team Leader & Data Analyst",
-        "Ali Alsheikh": "AI Engineer",
-        "Mohammed Azan": "UI/UX Designer",
-        "Abdulla Hilal": "Web Developer"
-    }
+        with rprt:
+            st.title(f"Comprehensive Agriculture Report: {place} ({date})")
+            if not report_requested:
+                st.button("Generate report", key="generate_report", on_click=request_report)
+        with dyrt:
+            st.title(f"Dynamic Agriculture Report: {place} ({date})")
+            if not report_requested:
+                st.button("Generate report", key="generate_dynamic_report", on_click=request_report)
+
+        if report_requested:
+            # Both report tabs read the same in-flight job, each section is shown as soon as it is complete
+            report_job = report_jobs.get_report_job(Ai_key, weather_df, pollen_df, temperature=0.3, max_tokens=4096,
+                                                    top_p=0.9, climate_df=climate_df)
+            try:
+                for i, chapter in enumerate(report_job.iter_sections()):
+                    with rprt:
+                        st.markdown(chapter)
+
+                    with dyrt:
+                        st.markdown(chapter)
+
+                        # Insert charts between chapters at specific points
+                        if i == 0:
+                            st.plotly_chart(fig2, use_container_width=True, key="dynamic_temp_humidity_chart")
+                        elif i == 1 and fig1 is not None:
+                            st.plotly_chart(fig1, use_container_width=True, key="dynamic_weed_pollen_chart")
+
+                        # Insert horizontally stacked current data metrics in a box
+                        if i == 2:
+                            with st.container():
+                                col1, col2, col3 = st.columns(3)
+                                with col1:
+                                    st.metric(label="Current Temperature (°C)", value=f"{avg_temp:.2f} °C")
+                                with col2:
+                                    st.metric(label="Current Humidity (%)", value=f"{avg_humidity:.2f} %")
+                                with col3:
+                                    st.metric(label="Current Precipitation (mm)", value=f"{total_precipitation:.2f} mm")
+            except Exception as e:
+                with rprt:
+                    st.error(f"Report generation failed: {e}")
+        elif prefetch_report:
+            # Charts are already on the page, start the report without waiting for it
+            report_jobs.get_report_job(Ai_key, weather_df, pollen_df, temperature=0.3, max_tokens=4096, top_p=0.9,
+                                       climate_df=climate_df)
+
+    # About Us tab
+    with about:
+        st.title("About Us")
+
+        st.header("Project Overview")
+        st.write(
+            """
+            Welcome to **Farmers Aid**! Our project is dedicated to helping farmers make data-driven decisions through real-time data analytics collected from NASA and public APIs. We strive to empower farmers with the insights they need to optimize their practices and improve yields.
+            """
+        )
+
+        st.header("Meet Our Team")
+        team_members = {
+            "Mohammed Aldaqaq": "Team Leader & Data Analyst",
+            "Ali Alsheikh": "AI Engineer",
+            "Mohammed Azan": "UI/UX Designer",
+            "Abdulla Hilal": "Web Developer"
+        }
 
-    with st.expander("Click to view team members"):
-        for name, role in team_members.items():
-            st.write(f"**{name}**: {role}")
-
-    st.header("Our Background")
-    st.write(
-        """
-        We are students at the **Nasser Vocational Training Centre (NVTC)**, where we are learning and developing our skills in technology and data science.
-        """
-    )
-
-    st.header("App Features")
-    st.write(
-        """
-        Our application performs data analytics to produce visual charts and sends the collected data to a large language model (LLM) for report generation. We combine these insights to create dynamic reports tailored to user needs. Additionally, we have developed a custom statistics AI assistant that provides personalized statistics based on user prompts and the provided data.
-        """
-    )
-
-    st.header("We Value Your Feedback!")
-    feedback = st.text_area("What do you think about Farmers Aid?", placeholder="Share your thoughts...")
-    if st.button("Submit Feedback"):
-        if feedback:
-            st.success("Thank you for your feedback!")
-        else:
-            st.warning("Please enter your feedback before submitting.")
-
-# FAQ tab
-with faq:
-    st.title("Frequently Asked Questions")
-    faqs = {
-        "What is Farmers Aid?":
-            "Farmers Aid is a project dedicated to helping farmers make data-driven decisions through real-time data analytics collected from NASA and public APIs. It aims to empower farmers with insights to optimize their practices and improve yields.",
-
-        "Who is behind Farmers Aid?":
-            "The Farmers Aid team consists of students from the Nasser Vocational Training Centre (NVTC):\n"
-            "1. Mohammed Aldaqaq - Team Leader & Data Analyst\n"
-            "2. Ali Alsheikh - AI Engineer\n"
-            "3. Mohammed Azan - UI/UX Designer\n"
-            "4. Abdulla Hilal - Web Developer",
-
-        "What is the main goal of Farmers Aid?":
-            "The main goal of Farmers Aid is to empower farmers with data-driven insights to optimize their farming practices and improve yields through real-time analytics and dynamic reports.",
-
-        "What does the application do?":
-            "The Farmers Aid application performs data analytics to create visual charts, sends the collected data to a large language model (LLM) for report generation, and produces personalized dynamic reports based on user needs. It also includes a custom AI assistant for generating personalized statistics.",
-
-        "Where are the team members from?":
-            "The team members are students from the Nasser Vocational Training Centre (NVTC), where they are developing their skills in technology and data science."
-    }
+        with st.expander("Click to view team members"):
+            for name, role in team_members.items():
+                st.write(f"**{name}**: {role}")
+
+        st.header("Our Background")
+        st.write(
+            """
+            We are students at the **Nasser Vocational Training Centre (NVTC)**, where we are learning and developing our skills in technology and data science.
+            """
+        )
+
+        st.header("App Features")
+        st.write(
+            """
+            Our application performs data analytics to produce visual charts and sends the collected data to a large language model (LLM) for report generation. We combine these insights to create dynamic reports tailored to user needs. Additionally, we have developed a custom statistics AI assistant that provides personalized statistics based on user prompts and the provided data.
+            """
+        )
+
+        st.header("We Value Your Feedback!")
+        feedback = st.text_area("What do you think about Farmers Aid?", placeholder="Share your thoughts...")
+        if st.button("Submit Feedback"):
+            if feedback:
+                st.success("Thank you for your feedback!")
+            else:
+                st.warning("Please enter your feedback before submitting.")
+
+    # FAQ tab
+    with faq:
+        st.title("Frequently Asked Questions")
+        faqs = {
+            "What is Farmers Aid?":
+                "Farmers Aid is a project dedicated to helping farmers make data-driven decisions through real-time data analytics collected from NASA and public APIs. It aims to empower farmers with insights to optimize their practices and improve yields.",
+
+            "Who is behind Farmers Aid?":
+                "The Farmers Aid team consists of students from the Nasser Vocational Training Centre (NVTC):\n"
+                "1. Mohammed Aldaqaq - Team Leader & Data Analyst\n"
+                "2. Ali Alsheikh - AI Engineer\n"
+                "3. Mohammed Azan - UI/UX Designer\n"
+                "4. Abdulla Hilal - Web Developer",
+
+            "What is the main goal of Farmers Aid?":
+                "The main goal of Farmers Aid is to empower farmers with data-driven insights to optimize their farming practices and improve yields through real-time analytics and dynamic reports.",
+
+            "What does the application do?":
+                "The Farmers Aid application performs data analytics to create visual charts, sends the collected data to a large language model (LLM) for report generation, and produces personalized dynamic reports based on user needs. It also includes a custom AI assistant for generating personalized statistics.",
+
+            "Where are the team members from?":
+                "The team members are students from the Nasser Vocational Training Centre (NVTC), where they are developing their skills in technology and data science."
+        }
 
-    for question, answer in faqs.items():
-        with st.expander(question):
-            st.write(answer)
\ No newline at end of file
+        for question, answer in faqs.items():
+            with st.expander(question):
+                st.write(answer)
+
+finally:
+    # The render is done once every tab has been drawn
+    metrics.deactivate(render_token)
+    render_span.end()
+if show_debug:
+    with dashb:
+        with st.expander("Timing details", expanded=True):
+            show_debug_panel(render_span.trace_id)
\ No newline at end of file
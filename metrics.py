@@ -0,0 +1,250 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# In-process metrics shared by the fetchers, caches and the AI client.
+# Every metric is keyed by its name plus an optional set of labels (e.g. provider='nasa').
+#
+# Spans time one piece of work (an upstream call, a DataFrame stage, a completion) and carry
+# its attributes: HTTP status, bytes, retries, token counts. Spans started inside another span
+# belong to the same trace, so one dashboard render can be looked at as a whole. The last
+# SPAN_BUFFER spans are kept in memory; with FARMERS_AID_SPAN_LOG set, every finished span is
+# also appended to that file as one JSON line.
+
+SPAN_BUFFER = 2000
+SPAN_LOG = os.environ.get('FARMERS_AID_SPAN_LOG')
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_timings = defaultdict(lambda: {'count': 0, 'sum': 0.0, 'max': 0.0})
+
+_spans = deque(maxlen=SPAN_BUFFER)
+_span_ids = itertools.count(1)
+_current_span = contextvars.ContextVar('current_span', default=None)
+_span_log_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# Add to a counter, e.g. increment('cache_hits', cache='history')
+def increment(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+# Set a gauge to its current value
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+# Record a duration in seconds
+def observe(name, seconds, **labels):
+    with _lock:
+        timing = _timings[_key(name, labels)]
+        timing['count'] += 1
+        timing['sum'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+
+
+def _format(key):
+    name, labels = key
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+# Return a copy of all metrics as plain dicts, handy for st.json or logging
+def snapshot():
+    with _lock:
+        return {
+            'counters': {_format(k): v for k, v in _counters.items()},
+            'gauges': {_format(k): v for k, v in _gauges.items()},
+            'timings': {_format(k): dict(v) for k, v in _timings.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
+        _spans.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _prometheus_key(name, labels, **extra):
+    labels = list(labels) + sorted(extra.items())
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+# All metrics in the Prometheus text exposition format. Timings are exported as summaries
+# (<name>_count, <name>_sum) plus a <name>_max gauge.
+def prometheus_text():
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        timings = sorted((k, dict(v)) for k, v in _timings.items())
+
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), value in counters:
+        declare(name, 'counter')
+        lines.append(f'{_prometheus_key(name, labels)} {value:g}')
+    for (name, labels), value in gauges:
+        declare(name, 'gauge')
+        lines.append(f'{_prometheus_key(name, labels)} {value:g}')
+    for (name, labels), timing in timings:
+        declare(name, 'summary')
+        lines.append(f"{_prometheus_key(name + '_count', labels)} {timing['count']}")
+        lines.append(f"{_prometheus_key(name + '_sum', labels)} {timing['sum']:.6f}")
+    for (name, labels), timing in timings:
+        declare(name + '_max', 'gauge')
+        lines.append(f"{_prometheus_key(name + '_max', labels)} {timing['max']:.6f}")
+    return '\n'.join(lines) + '\n'
+
+
+# Write prometheus_text() to a file atomically, e.g. for node_exporter's textfile collector
+def write_prometheus(path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+class Span:
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.attributes = dict(attributes)
+        self.status = 'ok'
+        self.error = None
+        self.started_at = time.time()
+        self.duration = None
+        self._start = time.perf_counter()
+
+    # Add or update attributes, e.g. span.set(http_status=200, bytes=1234)
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error):
+        self.status = 'error'
+        self.error = f'{type(error).__name__}: {error}'
+
+    def end(self):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        observe('span_seconds', self.duration, span=self.name)
+        if self.status == 'error':
+            increment('span_errors_total', span=self.name)
+        record = self.to_dict()
+        with _lock:
+            _spans.append(record)
+        if SPAN_LOG:
+            with _span_log_lock, open(SPAN_LOG, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_s': self.duration,
+            'status': self.status,
+            'error': self.error,
+            **self.attributes,
+        }
+
+
+# Start a span under the current one without making it current; call .end() when done.
+# For work that can't sit in a with block, like a generator that is consumed elsewhere.
+def start_span(name, **attributes):
+    return Span(name, parent=_current_span.get(), **attributes)
+
+
+# Time the block as a span; spans started inside it become its children.
+#
+#   with metrics.span('weather_frames') as span:
+#       ...
+#       span.set(rows=len(df))
+@contextmanager
+def span(name, **attributes):
+    current = start_span(name, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+# Decorator form of span: every call of the function is timed as a span
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, function=func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Make an already started span the current one (returns a token for deactivate)
+def activate(current):
+    return _current_span.set(current)
+
+
+def deactivate(token):
+    _current_span.reset(token)
+
+
+def current_span():
+    return _current_span.get()
+
+
+# Wrap func so it runs with the caller's current span, for work handed to a thread pool
+def bind_context(func):
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+
+# Finished spans (newest last) as dicts, optionally only those of one trace
+def spans(trace_id=None):
+    with _lock:
+        records = list(_spans)
+    if trace_id is not None:
+        records = [record for record in records if record['trace_id'] == trace_id]
+    return records
+
+
+# Finished spans as JSON lines
+def spans_jsonl(trace_id=None):
+    return ''.join(json.dumps(record, default=str) + '\n' for record in spans(trace_id))
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import metrics
+import snapshots
+
+# NASA POWER serves its meteorology on the MERRA-2 grid, so every point inside one
+# 0.5° x 0.625° cell gets the same values. This cache snaps coordinates to their cell and
+# keeps the daily values per (cell, parameter). A request only fetches the days that are
+# not cached yet, and farms in the same cell share one fetch. At most MAX_CELLS cells are kept
+# (least recently used ones are dropped) with at most MAX_DAYS days each.
+
+GRID_LAT_STEP = 0.5
+GRID_LON_STEP = 0.625
+
+# POWER marks days it has no data for yet with this value
+FILL_VALUE = -999.0
+# Fill values for recent days are retried after this many seconds (or right away within
+# snapshots.synchronous(force=True))
+FILL_RETRY_SECONDS = 60 * 60
+
+MAX_CELLS = 256
+MAX_DAYS = 366  # per cell and parameter, the oldest days are dropped first
+# Fetches of cells that share one of these locks wait for each other
+LOCK_STRIPES = 64
+
+
+# Center of the POWER grid cell containing the point
+def snap_to_cell(latitude, longitude):
+    lat = round(round(float(latitude) / GRID_LAT_STEP) * GRID_LAT_STEP, 4)
+    lon = round(round(float(longitude) / GRID_LON_STEP) * GRID_LON_STEP, 4)
+    return lat, lon
+
+
+def _date_range(start, end):
+    day = datetime.strptime(start, '%Y%m%d')
+    last = datetime.strptime(end, '%Y%m%d')
+    while day <= last:
+        yield day.strftime('%Y%m%d')
+        day += timedelta(days=1)
+
+
+# Group sorted YYYYMMDD dates into runs of consecutive days: [(start, end), ...]
+def _contiguous_runs(days):
+    runs = []
+    for day in days:
+        if runs:
+            previous = datetime.strptime(runs[-1][1], '%Y%m%d')
+            if datetime.strptime(day, '%Y%m%d') - previous == timedelta(days=1):
+                runs[-1][1] = day
+                continue
+        runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+
+class GridCellCache:
+    # fetch(latitude, longitude, start, end, parameters) must return
+    # {parameter: {YYYYMMDD: value}} for the cell center, or None on failure
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._values = OrderedDict()  # cell -> {parameter: {date: value}}, least recently used first
+        self._fill_checked = {}  # (cell, parameter, date) -> time the fill value was fetched
+        self._cell_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._lock = threading.Lock()
+
+    def _cell_lock(self, cell):
+        return self._cell_locks[hash(cell) % LOCK_STRIPES]
+
+    def _series(self, cell, parameter):
+        return self._values.get(cell, {}).get(parameter, {})
+
+    def _is_missing(self, cell, parameter, day, now):
+        value = self._series(cell, parameter).get(day)
+        if value is None:
+            return True
+        if value == FILL_VALUE:
+            return snapshots.forced() or now - self._fill_checked.get((cell, parameter, day), 0) > FILL_RETRY_SECONDS
+        return False
+
+    # Store fetched values for a cell and keep the cache within MAX_CELLS and MAX_DAYS
+    def _store(self, cell, data, now):
+        with self._lock:
+            series_of_cell = self._values.setdefault(cell, {})
+            self._values.move_to_end(cell)
+            for parameter, values in data.items():
+                series = series_of_cell.setdefault(parameter, {})
+                for day, value in values.items():
+                    series[day] = value
+                    if value == FILL_VALUE:
+                        self._fill_checked[(cell, parameter, day)] = now
+                for day in sorted(series)[:-MAX_DAYS]:
+                    del series[day]
+                    self._fill_checked.pop((cell, parameter, day), None)
+            while len(self._values) > MAX_CELLS:
+                evicted, _ = self._values.popitem(last=False)
+                for key in [key for key in self._fill_checked if key[0] == evicted]:
+                    del self._fill_checked[key]
+                metrics.increment('cache_evictions_total', cache='nasa_grid')
+
+    # Daily values for the point between start and end (YYYYMMDD, inclusive):
+    # {parameter: {date: value}}. Days that could not be fetched are left out.
+    def get(self, latitude, longitude, start, end, parameters):
+        cell = snap_to_cell(latitude, longitude)
+        days = list(_date_range(start, end))
+
+        # One fetch per cell at a time, later callers then find the days already cached
+        with self._cell_lock(cell):
+            now = time.time()
+            missing = sorted({day for parameter in parameters for day in days
+                              if self._is_missing(cell, parameter, day, now)})
+            if missing:
+                metrics.increment('cache_misses_total', len(missing), cache='nasa_grid')
+            metrics.increment('cache_hits_total', len(days) - len(missing), cache='nasa_grid')
+
+            for run_start, run_end in _contiguous_runs(missing):
+                data = self._fetch(cell[0], cell[1], run_start, run_end, parameters)
+                if data:
+                    self._store(cell, data, now)
+
+            with self._lock:
+                if cell in self._values:
+                    self._values.move_to_end(cell)
+                result = {}
+                for parameter in parameters:
+                    series = self._series(cell, parameter)
+                    result[parameter] = {day: series[day] for day in days if day in series}
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._fill_checked.clear()
@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from endpoints import storage_dir
+from nasa_grid import FILL_VALUE, snap_to_cell
+from weather import fetch_nasa_daily
+
+# Long-range NASA POWER history per grid cell, e.g. 30 years of daily values:
+#
+#   python nasa_ingest.py --lat 26.17 --lon 50.55 --years 30
+#   python nasa_ingest.py --farms farms.csv
+#
+# Each cell is stored as one float32 .npy array per parameter (day i = start + i days, NaN
+# where POWER has no value) plus a meta.json. The arrays can be memory-mapped, see
+# load_history. Re-running only requests the days after the last stored value.
+
+DATA_DIR = storage_dir(os.environ.get('FARMERS_AID_DATA_DIR', 'data'))
+NASA_STORE_DIR = os.path.join(DATA_DIR, 'nasa')
+
+DEFAULT_PARAMETERS = ['PRECTOTCORR', 'T2M', 'T2M_MAX', 'T2M_MIN', 'RH2M', 'WS2M', 'ALLSKY_SFC_SW_DWN']
+DEFAULT_YEARS = 30
+
+# POWER accepts up to 20 parameters per request, long ranges are split into yearly chunks
+MAX_PARAMETERS_PER_REQUEST = 20
+CHUNK_DAYS = 366
+
+# Chunks fetched at the same time and the request rate we allow ourselves
+CONCURRENCY = 4
+REQUESTS_PER_SECOND = 2.0
+
+
+class _RateLimiter:
+    def __init__(self, per_second):
+        self._interval = 1.0 / per_second
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def cell_dir(latitude, longitude):
+    lat, lon = snap_to_cell(latitude, longitude)
+    return os.path.join(NASA_STORE_DIR, f'{lat:+.4f}_{lon:+.4f}')
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Stored metadata (start, days, parameters, ...) for a location, None if never ingested
+def read_meta(latitude, longitude):
+    return _read_meta(cell_dir(latitude, longitude))
+
+
+def _write_meta(path, meta):
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+
+def _load_array(path, parameter, mmap=False):
+    try:
+        return np.load(os.path.join(path, f'{parameter}.npy'), mmap_mode='r' if mmap else None)
+    except FileNotFoundError:
+        return None
+
+
+def _save_array(path, parameter, values):
+    tmp = os.path.join(path, f'{parameter}.tmp.npy')
+    np.save(tmp, values.astype(np.float32))
+    os.replace(tmp, os.path.join(path, f'{parameter}.npy'))
+
+
+# Index after the last real value, i.e. where fetching should resume
+def _resume_index(values):
+    if values is None:
+        return 0
+    finite = np.flatnonzero(np.isfinite(values))
+    return int(finite[-1]) + 1 if len(finite) else 0
+
+
+def _chunks(start_index, end_index):
+    for chunk_start in range(start_index, end_index, CHUNK_DAYS):
+        yield chunk_start, min(chunk_start + CHUNK_DAYS, end_index)
+
+
+# Fetch and store the history of one location. Returns a summary dict.
+def ingest_location(latitude, longitude, years=DEFAULT_YEARS, parameters=None, end=None, rebuild=False):
+    parameters = list(parameters or DEFAULT_PARAMETERS)
+    lat, lon = snap_to_cell(latitude, longitude)
+    path = cell_dir(lat, lon)
+    if rebuild and os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+
+    # POWER data lags real time by a few days, missing recent days are retried next run
+    if end is None:
+        end_date = (datetime.now() - timedelta(days=1)).date()
+    elif isinstance(end, str):
+        end_date = datetime.strptime(end, '%Y%m%d').date()
+    else:
+        end_date = end
+    meta = _read_meta(path)
+    if meta is None:
+        start_date = end_date - timedelta(days=round(365.25 * years) - 1)
+        meta = {'latitude': lat, 'longitude': lon, 'start': start_date.strftime('%Y%m%d'), 'parameters': [],
+                'pending': []}
+    else:
+        start_date = datetime.strptime(meta['start'], '%Y%m%d').date()
+    # Never shrink what is already stored
+    total_days = max((end_date - start_date).days + 1, meta.get('days', 0))
+
+    # Extend every array to the new end and work out where each parameter resumes
+    arrays = {}
+    resume = {}
+    for parameter in parameters:
+        existing = _load_array(path, parameter)
+        values = np.full(total_days, np.nan, dtype=np.float32)
+        if existing is not None:
+            values[:min(len(existing), total_days)] = existing[:total_days]
+        arrays[parameter] = values
+        resume[parameter] = _resume_index(existing)
+
+    # Parameters resuming at the same day are fetched together
+    groups = {}
+    for parameter in parameters:
+        if resume[parameter] < total_days:
+            groups.setdefault(resume[parameter], []).append(parameter)
+    jobs = []
+    for start_index, group in groups.items():
+        for i in range(0, len(group), MAX_PARAMETERS_PER_REQUEST):
+            for chunk in _chunks(start_index, total_days):
+                jobs.append((chunk, group[i:i + MAX_PARAMETERS_PER_REQUEST]))
+    # Chunks that failed last time sit before the resume point, so retry them explicitly
+    for chunk_start, chunk_end, group in meta.get('pending', []):
+        group = [parameter for parameter in group if parameter in arrays]
+        if group:
+            jobs.append(((chunk_start, min(chunk_end, total_days)), group))
+
+    limiter = _RateLimiter(REQUESTS_PER_SECOND)
+
+    def fetch(job):
+        (chunk_start, chunk_end), group = job
+        limiter.wait()
+        first = (start_date + timedelta(days=chunk_start)).strftime('%Y%m%d')
+        last = (start_date + timedelta(days=chunk_end - 1)).strftime('%Y%m%d')
+        try:
+            return job, fetch_nasa_daily(lat, lon, first, last, group)
+        except Exception:
+            return job, None
+
+    pending = []
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        for ((chunk_start, chunk_end), group), data in pool.map(fetch, jobs):
+            if not data:
+                pending.append([chunk_start, chunk_end, group])
+                continue
+            for parameter in group:
+                for day, value in data.get(parameter, {}).items():
+                    index = (datetime.strptime(day, '%Y%m%d').date() - start_date).days
+                    if 0 <= index < total_days and value != FILL_VALUE:
+                        arrays[parameter][index] = value
+
+    for parameter, values in arrays.items():
+        _save_array(path, parameter, values)
+    meta['parameters'] = sorted(set(meta['parameters']) | set(parameters))
+    meta['days'] = total_days
+    meta['pending'] = pending
+    meta['updated_at'] = datetime.now().isoformat(timespec='seconds')
+    _write_meta(path, meta)
+
+    return {
+        'cell': [lat, lon],
+        'start': meta['start'],
+        'days': total_days,
+        'requests': len(jobs),
+        'failed_requests': len(pending),
+        'new_days': {parameter: max(_resume_index(arrays[parameter]) - resume[parameter], 0) for parameter in parameters},
+    }
+
+
+# Stored history for a location: (DatetimeIndex, {parameter: array}) or None if never ingested.
+# Arrays are memory-mapped read-only unless mmap=False.
+def load_history(latitude, longitude, parameters=None, mmap=True):
+    path = cell_dir(latitude, longitude)
+    meta = _read_meta(path)
+    if meta is None:
+        return None
+    arrays = {}
+    for parameter in parameters or meta['parameters']:
+        values = _load_array(path, parameter, mmap=mmap)
+        if values is not None:
+            arrays[parameter] = values
+    dates = pd.date_range(datetime.strptime(meta['start'], '%Y%m%d'), periods=meta['days'], freq='D')
+    return dates, arrays
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest multi-year NASA POWER history into the local store")
+    parser.add_argument('--lat', type=float, help="latitude of a single location")
+    parser.add_argument('--lon', type=float, help="longitude of a single location")
+    parser.add_argument('--farms', help="CSV with latitude and longitude columns (see batch.py)")
+    parser.add_argument('--years', type=int, default=DEFAULT_YEARS)
+    parser.add_argument('--parameters', default=','.join(DEFAULT_PARAMETERS))
+    parser.add_argument('--rebuild', action='store_true', help="drop the stored history and fetch it again")
+    args = parser.parse_args(argv)
+
+    if args.farms:
+        farms = pd.read_csv(args.farms)
+        points = list(zip(farms['latitude'], farms['longitude']))
+    elif args.lat is not None and args.lon is not None:
+        points = [(args.lat, args.lon)]
+    else:
+        parser.error("give either --lat/--lon or --farms")
+
+    # Farms in the same grid cell share one history
+    cells = sorted({snap_to_cell(lat, lon) for lat, lon in points})
+    for lat, lon in cells:
+        summary = ingest_location(lat, lon, years=args.years, parameters=args.parameters.split(','),
+                                  rebuild=args.rebuild)
+        print(json.dumps(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,22 @@
 import requests
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import pandas as pd
 import streamlit as st
-from datetime import datetime, timedelta
+import deadline
+import http_client
+import metrics
+from endpoints import base_url
+import snapshots
+from pollen_store import FORECAST, OBSERVED, PollenStore
 
 API_KEY = st.secrets["AMBEE_API_KEY"]
 
+# Ambee API URL (configurable, see endpoints.py)
+AMBEE_URL = base_url('ambee')
+
 # Headers including the API key
 headers = {
     'x-api-key': API_KEY,
@@ -13,84 +25,147 @@ headers = {
 }
 
 
-# Get current pollen data for a place
-def get_latest_pollen_data(place):
-    url = f"https://api.ambeedata.com/latest/pollen/by-place?place={place}"
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        if 'data' in data:
-            return data['data']
-    except requests.RequestException:
-        return None  # Return None if API request fails
-    return None
+# Hourly pollen per place is kept in a local store (see pollen_store.py) and refreshed
+# incrementally: Ambee publishes observations hourly and forecasts change slowly, so a
+# place is asked at most every POLL_EVERY seconds and only for hours after its watermark.
+OBSERVED_EVERY = 60 * 60
+FORECAST_EVERY = 60 * 60
+POLL_EVERY = 15 * 60
+# How far back a first refresh (or the first after a long gap) fills in, in 48 hour requests
+HISTORY_DAYS = 7
+HISTORY_CHUNK = 48 * 60 * 60
+# What the dashboard reads from the store, around now
+WINDOW_BEFORE = 7 * 24 * 60 * 60
+WINDOW_AFTER = 3 * 24 * 60 * 60
 
+pollen_history = PollenStore(retention=WINDOW_BEFORE)
 
-# Get 1 day forecast pollen data for a place
-def get_forecast_pollen_data(place):
-    url = f"https://api.ambeedata.com/forecast/pollen/by-place?place={place}"
+# Statuses Ambee answers with when the API key's plan doesn't include an endpoint
+NO_ACCESS = (401, 403)
+
+
+# The 'data' of an Ambee response, None if the request failed (denied when the plan has no
+# access to the endpoint)
+def _fetch_pollen(url, params=None, denied=None):
     try:
-        response = requests.get(url, headers=headers)
+        response = http_client.get('ambee', url, params=params, headers=headers)
+        if response.status_code in NO_ACCESS:
+            return denied
         response.raise_for_status()
         data = response.json()
         if 'data' in data:
             return data['data']
-    except requests.RequestException:
+    except (requests.RequestException, ValueError):
         return None  # Return None if API request fails
     return None
 
 
-# Function to fetch pollen data and return the combined DataFrame
-def get_combined_pollen_data(place):
-    # Fetch latest pollen data
-    latest_pollen = get_latest_pollen_data(place)
-
-    # Fetch forecast pollen data (1 day)
-    forecast_pollen = get_forecast_pollen_data(place)
-
-    # Initialize list for DataFrames
-    similar_columns_dfs = []
-
-    if latest_pollen:
-        # Flatten the latest_df
-        latest_df_flat = pd.json_normalize(latest_pollen)
-        similar_columns_dfs.append(latest_df_flat)
-
-    if forecast_pollen:
-        # Flatten the forecast_df
-        forecast_df_flat = pd.json_normalize(forecast_pollen)
-        similar_columns_dfs.append(forecast_df_flat)
-
-    # Combine all DataFrames with similar columns
-    if similar_columns_dfs:
-        combined_similar_df = pd.concat(similar_columns_dfs, ignore_index=True)
-        return combined_similar_df
-    else:
-        # If no data from the API, fall back to 'pollen-backup.csv'
-        try:
-            fallback_df = pd.read_csv('pollen-backup.csv')
-
-            # Get current date
-            current_date = datetime.now()
-
-            # Calculate date range
-            start_date = current_date - timedelta(days=1)
-            end_date = current_date + timedelta(days=1)
+def _place_key(place):
+    return ' '.join(str(place).split()).lower()
 
-            # Generate new dates
-            new_dates = pd.date_range(start=start_date, end=end_date, freq='H')
 
-            # Ensure the DataFrame has the same number of rows as new_dates
-            fallback_df = fallback_df.iloc[:len(new_dates)].copy()
-
-            # Update the 'updatedAt' column with new dates
-            fallback_df['updatedAt'] = new_dates.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+# Get current pollen data for a place
+def get_latest_pollen_data(place):
+    return _fetch_pollen(f"{AMBEE_URL}/latest/pollen/by-place?place={place}")
 
-            # Update the 'time' column (Unix timestamp)
-            fallback_df['time'] = new_dates.astype('int64') // 10 ** 9
 
-            return fallback_df
-        except FileNotFoundError:
-            st.error("Pollen data not available, and fallback CSV not found.")
-            return pd.DataFrame()  # Return empty DataFrame if no data is available
\ No newline at end of file
+# Get 1 day forecast pollen data for a place
+def get_forecast_pollen_data(place):
+    return _fetch_pollen(f"{AMBEE_URL}/forecast/pollen/by-place?place={place}")
+
+
+# Get observed hourly pollen data for a place between two epoch times (UTC). None if the
+# request failed, [] if there is nothing to get (also when the plan has no history access).
+def get_history_pollen_data(place, start, end):
+    params = {
+        'place': place,
+        'from': datetime.fromtimestamp(start, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        'to': datetime.fromtimestamp(end, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    return _fetch_pollen(f"{AMBEE_URL}/history/pollen/by-place", params=params, denied=[])
+
+
+# Bring the stored observations up to date, False if Ambee failed
+def _refresh_observed(place, key, now):
+    newest, fetched_at = pollen_history.watermark(key, OBSERVED) or (None, None)
+    if fetched_at is not None and not snapshots.forced() and \
+            (now - fetched_at < POLL_EVERY or (newest and now - newest < OBSERVED_EVERY)):
+        return True  # nothing new published yet
+
+    # Hours missed since the watermark (or the last HISTORY_DAYS on a first refresh) come from
+    # the history endpoint, the current hour from latest
+    since = max((newest or 0) + OBSERVED_EVERY, now - HISTORY_DAYS * 24 * 60 * 60)
+    rows = []
+    gap = False
+    while now - since > 2 * OBSERVED_EVERY:
+        chunk = get_history_pollen_data(place, since, min(since + HISTORY_CHUNK, now))
+        if chunk is None:
+            gap = True  # failed, the watermark stays before it so the next refresh retries
+            break
+        rows += chunk
+        since += HISTORY_CHUNK
+    latest = get_latest_pollen_data(place)
+    if latest is None and not rows:
+        return False
+    if rows:
+        pollen_history.upsert(key, OBSERVED, rows)
+    if latest:
+        pollen_history.upsert(key, OBSERVED, latest, advance=not gap)
+    return True
+
+
+# Replace the stored forecast once it is older than FORECAST_EVERY, False if Ambee failed
+def _refresh_forecast(place, key, now):
+    mark = pollen_history.watermark(key, FORECAST)
+    if mark is not None and not snapshots.forced() and now - mark[1] < FORECAST_EVERY:
+        return True
+    forecast = get_forecast_pollen_data(place)
+    if forecast is None:
+        return False
+    pollen_history.upsert(key, FORECAST, forecast)
+    return True
+
+
+# Fetch what changed for a place since its watermarks (also when asked within POLL_EVERY and
+# FORECAST_EVERY inside snapshots.synchronous(force=True)). With Ambee down the stored rows are
+# still served, flagged stale (see snapshots.track).
+def refresh_pollen(place):
+    key = _place_key(place)
+    now = time.time()
+    with metrics.span('pollen_fetch', place=place):
+        # Observations and forecast at the same time, within the render's budget (see deadline.py)
+        pool = ThreadPoolExecutor(max_workers=2)
+        try:
+            observed_future = pool.submit(metrics.bind_context(_refresh_observed), place, key, now)
+            forecast_future = pool.submit(metrics.bind_context(_refresh_forecast), place, key, now)
+            results = {OBSERVED: deadline.result(observed_future, 'ambee'),
+                       FORECAST: deadline.result(forecast_future, 'ambee')}
+        finally:
+            pool.shutdown(wait=False)
+
+    failed = [pollen_history.watermark(key, source) for source, ok in results.items() if ok is False]
+    stored = [mark[1] for mark in failed if mark is not None]
+    if stored:
+        snapshots.mark_stale('ambee', key, min(stored))
+    elif not failed and None not in results.values():
+        snapshots.mark_fresh('ambee', key)
+
+
+# Function to fetch pollen data and return the DataFrame the dashboard shows: the stored
+# hours from WINDOW_BEFORE ago to WINDOW_AFTER ahead, observed and forecast.
+# When Ambee fails and nothing was stored before either, or the store can't be used, the
+# DataFrame is empty.
+def get_combined_pollen_data(place):
+    try:
+        refresh_pollen(place)
+    except sqlite3.Error:
+        metrics.increment('pollen_store_errors_total')
+    now = time.time()
+    with metrics.span('pollen_frames') as span:
+        try:
+            df = pollen_history.window(_place_key(place), now - WINDOW_BEFORE, now + WINDOW_AFTER)
+        except sqlite3.Error:
+            metrics.increment('pollen_store_errors_total')
+            df = pd.DataFrame()
+        span.set(rows=len(df))
+    return df
\ No newline at end of file
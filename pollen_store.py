@@ -0,0 +1,154 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+import metrics
+from endpoints import storage_dir
+
+# Local hourly pollen time series per place, backed by SQLite. Rows are keyed by place and
+# hour, so refetching an hour replaces it instead of adding a duplicate. Observed rows
+# (Ambee latest/history) always win; forecast rows only replace other forecast rows, and are
+# replaced by the observed row once that hour has passed.
+#
+# Each place has a watermark per source: the newest hour stored and when it was last
+# fetched. pollen.refresh_pollen uses them to ask Ambee only for what it doesn't have yet.
+#
+# With a retention, every upsert also drops rows older than it and the watermarks of places
+# not fetched within it. Forecast rows are dropped once their hour has passed: an hour that was
+# never observed is left out rather than shown with what was forecast for it.
+
+DATA_DIR = storage_dir(os.environ.get('FARMERS_AID_DATA_DIR', 'data'))
+
+OBSERVED = 'observed'
+FORECAST = 'forecast'
+
+
+# {'Count': {'weed_pollen': 3}} -> {'Count.weed_pollen': 3}, the columns json_normalize makes
+def flatten(row, prefix=''):
+    flat = {}
+    for key, value in row.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+# Epoch hour of an Ambee row: its 'time', or for rows without one (latest) the hour of its
+# 'updatedAt'. None if it has neither.
+def row_time(row):
+    if row.get('time') is not None:
+        return int(row['time'])
+    try:
+        updated = datetime.fromisoformat(row['updatedAt'].replace('Z', '+00:00'))
+    except (KeyError, AttributeError, ValueError):
+        return None
+    return int(updated.timestamp()) // 3600 * 3600
+
+
+class PollenStore:
+    # retention in seconds, None keeps everything
+    def __init__(self, path=None, retention=None):
+        self.path = path or os.path.join(DATA_DIR, 'pollen.sqlite3')
+        self.retention = retention
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pollen ('
+            ' place TEXT NOT NULL,'
+            ' time INTEGER NOT NULL,'
+            ' source TEXT NOT NULL,'
+            ' fetched_at REAL NOT NULL,'
+            ' row TEXT NOT NULL,'
+            ' PRIMARY KEY (place, time))'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS watermarks ('
+            ' place TEXT NOT NULL,'
+            ' source TEXT NOT NULL,'
+            ' time INTEGER NOT NULL,'
+            ' fetched_at REAL NOT NULL,'
+            ' PRIMARY KEY (place, source))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS pollen_time ON pollen (time)')
+        self._conn.commit()
+
+    # Store Ambee rows for a place, keyed by row_time() (rows without one are skipped), and move
+    # its watermark; with advance=False only its fetch time moves (rows after a gap that is
+    # still to be filled). Returns the number of rows written.
+    def upsert(self, place, source, rows, advance=True):
+        now = time.time()
+        records = []
+        for row in rows:
+            hour = row_time(row)
+            if hour is None:
+                metrics.increment('pollen_store_skipped_total', source=source)
+                continue
+            records.append((place, hour, source, now, json.dumps({**flatten(row), 'time': hour})))
+        with self._lock:
+            cursor = self._conn.executemany(
+                'INSERT INTO pollen (place, time, source, fetched_at, row) VALUES (?, ?, ?, ?, ?)'
+                ' ON CONFLICT (place, time) DO UPDATE SET'
+                '  source = excluded.source, fetched_at = excluded.fetched_at, row = excluded.row'
+                f" WHERE excluded.source = '{OBSERVED}' OR pollen.source = '{FORECAST}'",
+                records
+            )
+            written = cursor.rowcount
+            newest = max((record[1] for record in records), default=None) if advance else None
+            self._conn.execute(
+                'INSERT INTO watermarks (place, source, time, fetched_at) VALUES (?, ?, ?, ?)'
+                ' ON CONFLICT (place, source) DO UPDATE SET'
+                '  time = MAX(watermarks.time, excluded.time), fetched_at = excluded.fetched_at',
+                (place, source, newest if newest is not None else 0, now)
+            )
+            pruned = self._prune(now)
+            self._conn.commit()
+        metrics.increment('pollen_store_rows_total', written, source=source)
+        if pruned:
+            metrics.increment('pollen_store_pruned_total', pruned)
+        return written
+
+    # Drop rows past the retention and forecasts for hours that have passed (caller holds the lock)
+    def _prune(self, now):
+        pruned = self._conn.execute(f"DELETE FROM pollen WHERE source = '{FORECAST}' AND time <= ?",
+                                    (int(now) - 60 * 60,)).rowcount
+        if self.retention is not None:
+            cutoff = int(now - self.retention)
+            pruned += self._conn.execute('DELETE FROM pollen WHERE time < ?', (cutoff,)).rowcount
+            self._conn.execute('DELETE FROM watermarks WHERE fetched_at < ?', (cutoff,))
+        return pruned
+
+    # (newest hour stored, last fetch time) for a place and source, None if never fetched
+    def watermark(self, place, source):
+        with self._lock:
+            row = self._conn.execute('SELECT time, fetched_at FROM watermarks WHERE place = ? AND source = ?',
+                                     (place, source)).fetchone()
+        return None if row is None else (row[0] or None, row[1])
+
+    # Rows for start <= time < end (epoch seconds) as a DataFrame sorted by time
+    def window(self, place, start, end):
+        with self._lock:
+            rows = self._conn.execute('SELECT row FROM pollen WHERE place = ? AND time >= ? AND time < ?'
+                                      ' ORDER BY time', (place, int(start), int(end))).fetchall()
+        return pd.DataFrame.from_records([json.loads(row[0]) for row in rows])
+
+    # Drop everything stored for a place, or everything
+    def clear(self, place=None):
+        with self._lock:
+            if place is None:
+                self._conn.execute('DELETE FROM pollen')
+                self._conn.execute('DELETE FROM watermarks')
+            else:
+                self._conn.execute('DELETE FROM pollen WHERE place = ?', (place,))
+                self._conn.execute('DELETE FROM watermarks WHERE place = ?', (place,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
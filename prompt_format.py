@@ -0,0 +1,129 @@
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+# Compact, deterministic text encoding of the DataFrames we send to the LLM.
+# Columns with the same value on every row (Location, Country, timezone, ...) are written
+# once as a header, numbers are rounded, hourly pollen is summarised per day and the
+# whole table is kept under a token budget instead of being silently truncated.
+
+# Token budget for all tables in one prompt
+PROMPT_TOKEN_BUDGET = 3000
+
+# Rough token count: every word, number and punctuation mark counts as one token,
+# which is close to (and slightly above) what BPE tokenizers produce for tables
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    return len(_TOKEN_RE.findall(text))
+
+
+def _format_value(value, decimals):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    if isinstance(value, pd.Timestamp):
+        if value.hour == 0 and value.minute == 0 and value.second == 0:
+            return value.strftime('%Y-%m-%d')
+        return value.strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, (float, np.floating)):
+        value = round(float(value), decimals)
+        return f'{value:.{decimals}f}'.rstrip('0').rstrip('.') if decimals else str(int(value))
+    return str(value)
+
+
+# Format a whole column; datetime columns are formatted in one go (date only if every value is midnight)
+def _format_column(series, decimals):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        at_midnight = (series.dt.normalize() == series) | series.isna()
+        return series.dt.strftime('%Y-%m-%d' if at_midnight.all() else '%Y-%m-%d %H:%M').fillna('').tolist()
+    return [_format_value(value, decimals) for value in series.tolist()]
+
+
+# True for the Ambee frame, which has an hourly 'time' column and Count.* columns
+def is_pollen_frame(df):
+    return 'time' in df.columns and any(col.startswith('Count.') for col in df.columns)
+
+
+# Summarise hourly pollen rows into one row per day: mean and max counts, most common risk level
+def daily_pollen_summary(df):
+    times = df['time']
+    if pd.api.types.is_numeric_dtype(times):
+        times = pd.to_datetime(times, unit='s')
+    else:
+        times = pd.to_datetime(times)
+    day = times.dt.strftime('%Y-%m-%d').rename('Date')
+
+    count_cols = [col for col in df.columns if col.startswith('Count.')]
+    risk_cols = [col for col in df.columns if col.startswith('Risk.')]
+    grouped = df.groupby(day, sort=True)
+
+    summary = pd.DataFrame(index=grouped.size().index)
+    for col in count_cols:
+        name = col.split('.', 1)[1]
+        summary[f'{name} avg'] = grouped[col].mean()
+        summary[f'{name} max'] = grouped[col].max()
+    for col in risk_cols:
+        name = col.split('.', 1)[1]
+        # Alphabetical max is not a risk order, so pick the most frequent level of the day
+        summary[f'{name} risk'] = grouped[col].agg(lambda s: s.mode().iloc[0] if not s.mode().empty else '')
+    return summary.reset_index()
+
+
+# Encode one frame as a compact pipe-separated table that fits in max_tokens
+def encode_frame(df, decimals=2, max_tokens=None):
+    if df is None or df.empty:
+        return '(no data)'
+    if is_pollen_frame(df):
+        df = daily_pollen_summary(df)
+
+    # Hoist constant columns into a header
+    header = []
+    body_cols = []
+    for col in df.columns:
+        if len(df) > 1 and df[col].nunique(dropna=False) == 1:
+            header.append(f'{col}: {_format_value(df[col].iloc[0], decimals)}')
+        else:
+            body_cols.append(col)
+
+    lines = header + ['|'.join(str(col) for col in body_cols)]
+    columns = [_format_column(df[col], decimals) for col in body_cols]
+    rows = ['|'.join(values) for values in zip(*columns)]
+
+    if max_tokens is not None:
+        rows = _fit_rows(rows, budget=max_tokens - estimate_tokens('\n'.join(lines)))
+    return '\n'.join(lines + rows)
+
+
+# Keep as many rows as fit in the budget, spread evenly over the table so the whole
+# time span stays visible, and say how many were left out
+def _fit_rows(rows, budget):
+    costs = [estimate_tokens(row) for row in rows]
+    if sum(costs) <= budget:
+        return rows
+    note_cost = 12
+    average = max(sum(costs) / len(costs), 1)
+    keep = max(int((budget - note_cost) // average), 1)
+    while keep > 1:
+        indices = np.unique(np.linspace(0, len(rows) - 1, keep).round().astype(int))
+        if sum(costs[i] for i in indices) + note_cost <= budget:
+            break
+        keep -= 1
+    else:
+        indices = [0]
+    kept = [rows[i] for i in indices]
+    kept.append(f'({len(rows) - len(kept)} of {len(rows)} rows omitted to fit the token budget)')
+    return kept
+
+
+# Encode several frames, sharing the prompt token budget equally between them
+def encode_frames(*frames, token_budget=PROMPT_TOKEN_BUDGET, decimals=2):
+    per_frame = token_budget // max(len(frames), 1)
+    with metrics.span('prompt_encode', frames=len(frames)) as span:
+        encoded = [encode_frame(df, decimals=decimals, max_tokens=per_frame) for df in frames]
+        span.set(prompt_tokens=sum(estimate_tokens(text) for text in encoded))
+    return encoded
@@ -0,0 +1,173 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+import deadline
+import metrics
+from disk_cache import CACHE_ROOT
+from endpoints import DEFAULTS, base_url
+
+# Per-provider request limits, used by http_client.get before anything goes out:
+#
+#   - a token bucket per provider smooths bursts to `rate` requests a second (at most `burst`
+#     back to back); a caller that would wait longer than MAX_WAIT, or than what is left of
+#     the render's budget (see deadline.py), gets QuotaExceeded instead
+#   - a daily quota per provider counts every upstream request, retries included, per UTC
+#     day. Counts live in SQLite so the dashboard and ingest_worker.py share one budget; once
+#     it is spent calls fail fast with QuotaExceeded and callers fall back to stored data.
+#
+# Today's usage is the quota_used / quota_limit gauges. The limits below are defaults, set
+# them to the plan's with <PROVIDER>_RATE, <PROVIDER>_BURST and <PROVIDER>_DAILY_QUOTA
+# (e.g. AMBEE_DAILY_QUOTA=100); an empty daily quota means unlimited.
+
+LIMITS = {
+    'weatherapi': {'rate': 20.0, 'burst': 40, 'daily': 30_000},
+    'ambee': {'rate': 2.0, 'burst': 5, 'daily': 3_000},
+    'nasa': {'rate': 2.0, 'burst': 4, 'daily': 10_000},
+    'ipinfo': {'rate': 5.0, 'burst': 5, 'daily': 1_500},
+}
+MAX_WAIT = 10  # seconds a caller may queue for a token
+
+
+# A RequestException, so the fetchers treat it like any failed call
+class QuotaExceeded(requests.RequestException):
+    pass
+
+
+def _setting(provider, name, default):
+    value = os.environ.get(f'{provider.upper()}_{name.upper()}')
+    if value is None:
+        return default
+    return float(value) if value.strip() else None
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Take one token, waiting for it when the bucket is empty; False if that would exceed max_wait
+    def acquire(self, max_wait=MAX_WAIT):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            if wait > max_wait:
+                return False
+            # The token is taken now; later callers queue behind it
+            self._tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+
+class DailyQuota:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_ROOT, 'quota.sqlite3')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS usage ('
+            ' provider TEXT NOT NULL,'
+            ' day TEXT NOT NULL,'
+            ' used INTEGER NOT NULL,'
+            ' PRIMARY KEY (provider, day))'
+        )
+        self._conn.commit()
+
+    # Count n requests against today's quota; False (and nothing counted) if they don't fit.
+    # force=True counts them anyway, for requests that already went out (retries).
+    def consume(self, provider, limit, n=1, force=False):
+        day = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO usage (provider, day, used) VALUES (?, ?, 0)'
+                               ' ON CONFLICT (provider, day) DO NOTHING', (provider, day))
+            cursor = self._conn.execute(
+                'UPDATE usage SET used = used + ? WHERE provider = ? AND day = ? AND (? OR ? IS NULL OR used + ? <= ?)',
+                (n, provider, day, force, limit, n, limit)
+            )
+            used = self._conn.execute('SELECT used FROM usage WHERE provider = ? AND day = ?',
+                                      (provider, day)).fetchone()[0]
+        metrics.set_gauge('quota_used', used, provider=provider)
+        return cursor.rowcount > 0
+
+    # Requests counted today per provider
+    def usage(self):
+        day = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        with self._lock:
+            rows = self._conn.execute('SELECT provider, used FROM usage WHERE day = ?', (day,)).fetchall()
+        return dict(rows)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_quota = None
+
+
+def _daily_quota():
+    global _quota
+    with _buckets_lock:
+        if _quota is None:
+            _quota = DailyQuota()
+        return _quota
+
+
+def _bucket(provider):
+    with _buckets_lock:
+        if provider not in _buckets:
+            limits = LIMITS.get(provider)
+            # The plan's limits don't apply to stand-ins (stub_server.py and other overrides)
+            if limits is None or base_url(provider) != DEFAULTS[provider]:
+                _buckets[provider] = None
+            else:
+                _buckets[provider] = TokenBucket(_setting(provider, 'rate', limits['rate']),
+                                                 _setting(provider, 'burst', limits['burst']))
+        return _buckets[provider]
+
+
+def daily_limit(provider):
+    limits = LIMITS.get(provider)
+    return None if limits is None else _setting(provider, 'daily_quota', limits['daily'])
+
+
+# Wait for a token and count one request against the daily quota, or raise QuotaExceeded
+def acquire(provider):
+    bucket = _bucket(provider)
+    if bucket is None:
+        return
+    limit = daily_limit(provider)
+    if limit is not None:
+        metrics.set_gauge('quota_limit', limit, provider=provider)
+    remaining = deadline.remaining()
+    max_wait = MAX_WAIT if remaining is None else min(MAX_WAIT, remaining)
+    if not bucket.acquire(max_wait):
+        metrics.increment('quota_rejected_total', provider=provider, reason='rate')
+        raise QuotaExceeded(f"{provider} is rate limited, no request slot within {max_wait:.1f}s")
+    if not _daily_quota().consume(provider, limit):
+        metrics.increment('quota_rejected_total', provider=provider, reason='daily')
+        raise QuotaExceeded(f"{provider} daily quota of {limit:.0f} requests is used up")
+
+
+# Count requests that went out without acquire(), e.g. urllib3 retries
+def record_extra(provider, n):
+    if n and _bucket(provider) is not None:
+        _daily_quota().consume(provider, daily_limit(provider), n, force=True)
+
+
+# Give back the quota of an acquire() whose request did not go out after all
+def release(provider):
+    record_extra(provider, -1)
+
+
+# Requests used today per provider, as counted by the shared quota store
+def usage():
+    return _daily_quota().usage()
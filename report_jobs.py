@@ -0,0 +1,75 @@
+import threading
+
+import AI
+
+# Report generation running on a background thread. Jobs are shared process-wide and
+# keyed by the report's content hash, so the Report and Dynamic Report tabs (and other
+# sessions asking for the same report) read from one in-flight completion.
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class ReportJob:
+    def __init__(self, key, deltas):
+        self.key = key
+        self.sections = []
+        self.done = False
+        self.error = None
+        self._deltas = deltas
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f'report-{key[:8]}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for section in AI.iter_sections(self._deltas, name='report'):
+                with self._cond:
+                    self.sections.append(section)
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+            # Finished reports are served by the report cache from now on
+            with _jobs_lock:
+                if _jobs.get(self.key) is self:
+                    del _jobs[self.key]
+
+    # Yield every section from the start, waiting for new ones until the job finishes.
+    # Re-raises the generation error, if any, after the sections received so far.
+    def iter_sections(self):
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.sections) and not self.done:
+                    self._cond.wait()
+                if i < len(self.sections):
+                    section = self.sections[i]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            i += 1
+            yield section
+
+
+# Return the in-flight job for this report, starting one if there is none.
+# Nothing is generated until this is called, so callers decide when a report is needed.
+def get_report_job(auth_token, df1, df2, temperature=0.3, max_tokens=4096, top_p=0.9, refresh=False, climate_df=None):
+    key = AI.agricultural_report_key(df1, df2, temperature=temperature, max_tokens=max_tokens, top_p=top_p,
+                                     climate_df=climate_df)
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is None:
+            deltas = AI.stream_agricultural_response(auth_token, df1, df2, temperature=temperature,
+                                                     max_tokens=max_tokens, top_p=top_p, refresh=refresh,
+                                                     climate_df=climate_df)
+            job = _jobs[key] = ReportJob(key, deltas)
+            job.start()
+    return job
@@ -0,0 +1,186 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+import metrics
+from disk_cache import DiskCache
+
+# Last-known-good responses per provider, served stale-while-revalidate:
+#
+#   - a snapshot younger than fresh_for is served as is, without calling the provider
+#   - an older snapshot is served right away and marked stale, and a background thread
+#     fetches a new one (one at a time per key, retried at most every REVALIDATE_BACKOFF)
+#   - without any snapshot the caller waits for the fetch
+#
+# A render therefore never waits on a provider it already has data for, even when that
+# provider is down, and never sees made-up data: the worst case is old real data. What was
+# served stale is collected by track() around the work that built the frames, so the UI can
+# say so for exactly the data it shows. Every successful background refresh bumps
+# generation(), which the data layer uses to drop frames built from stale snapshots.
+#
+# Code that is itself the background (the ingestion worker) runs inside synchronous(): there
+# a snapshot past fresh_for is fetched right away, and only served stale if that fails. With
+# force=True (the dashboard's refresh button) every snapshot that can go stale is fetched.
+
+REVALIDATE_BACKOFF = 60  # seconds between background attempts for a failing key
+# Keys not served stale again within this many seconds drop out of the snapshot_stale gauge
+STALE_EXPIRY = 60 * 60
+
+_lock = threading.Lock()
+_stale = {}  # (provider, key) -> (time the served snapshot was fetched, time it was last served)
+_served = contextvars.ContextVar('stale_served', default=None)
+_synchronous = contextvars.ContextVar('synchronous', default=None)  # None, DUE or ALL
+DUE = 'due'
+ALL = 'all'
+_generation = 0
+
+
+class SnapshotStore:
+    def __init__(self, provider, max_bytes=20 * 1024 * 1024):
+        self.provider = provider
+        self._cache = DiskCache(f'snapshots_{provider}', max_bytes=max_bytes)
+        self._revalidating = set()
+        self._last_attempt = {}
+
+    # Data for key. fetch() returns the data or None (or raises a RequestException) on failure;
+    # fresh_for=None means a snapshot never goes stale (e.g. a past day's history).
+    # Returns None only when the provider fails and there has never been a snapshot.
+    def get(self, key, fetch, fresh_for=None):
+        entry = self._cache.get(key)
+        if entry is not None:
+            age = time.time() - entry['fetched_at']
+            if fresh_for is None or (age <= fresh_for and _synchronous.get() != ALL):
+                metrics.increment('snapshot_served_total', provider=self.provider, state='fresh')
+                return entry['data']
+            if _synchronous.get():
+                data = self._fetch(key, fetch)
+                if data is not None:
+                    metrics.increment('snapshot_served_total', provider=self.provider, state='fetched')
+                    mark_fresh(self.provider, key, changed=True)
+                    return data
+            metrics.increment('snapshot_served_total', provider=self.provider, state='stale')
+            self._mark_stale(key, entry['fetched_at'])
+            if not _synchronous.get():
+                self._revalidate_later(key, fetch)
+            return entry['data']
+
+        data = self._fetch(key, fetch)
+        metrics.increment('snapshot_served_total', provider=self.provider,
+                          state='fetched' if data is not None else 'missing')
+        return data
+
+    def _fetch(self, key, fetch):
+        try:
+            data = fetch()
+        except (requests.RequestException, ValueError, KeyError):
+            data = None
+        if data is None:
+            return None
+        self._cache.set(key, {'data': data, 'fetched_at': time.time()})
+        return data
+
+    def _revalidate_later(self, key, fetch):
+        now = time.monotonic()
+        with _lock:
+            if key in self._revalidating or now - self._last_attempt.get(key, -REVALIDATE_BACKOFF) < REVALIDATE_BACKOFF:
+                return
+            self._revalidating.add(key)
+            self._last_attempt[key] = now
+        threading.Thread(target=self._revalidate, args=(key, fetch), name=f'revalidate-{self.provider}',
+                         daemon=True).start()
+
+    def _revalidate(self, key, fetch):
+        try:
+            if self._fetch(key, fetch) is None:
+                metrics.increment('snapshot_revalidation_failures_total', provider=self.provider)
+                return
+            with _lock:
+                self._last_attempt.pop(key, None)
+            mark_fresh(self.provider, key, changed=True)
+            metrics.increment('snapshot_revalidations_total', provider=self.provider)
+        finally:
+            with _lock:
+                self._revalidating.discard(key)
+
+    def _mark_stale(self, key, fetched_at):
+        mark_stale(self.provider, key, fetched_at)
+
+    def clear(self):
+        self._cache.clear()
+        with _lock:
+            for stale_key in [k for k in _stale if k[0] == self.provider]:
+                del _stale[stale_key]
+        _update_stale_gauge(self.provider)
+
+
+# Collect what the block is served stale (thread pool work included, see metrics.bind_context):
+#
+#   with snapshots.track() as stale:
+#       real_df, weather_df = get_combined_weather_data(...)
+#   stale  # {provider: fetch time of the oldest stale data served}
+@contextmanager
+def track():
+    served = {}
+    token = _served.set(served)
+    try:
+        yield served
+    finally:
+        _served.reset(token)
+
+
+# Fetch snapshots past fresh_for within the block instead of serving them stale and
+# revalidating in the background (a short-lived process would exit before that finishes);
+# force=True fetches the ones still within fresh_for too
+@contextmanager
+def synchronous(force=False):
+    token = _synchronous.set(ALL if force else DUE)
+    try:
+        yield
+    finally:
+        _synchronous.reset(token)
+
+
+# True within synchronous(force=True), for stores that keep their own data (like the pollen
+# store) to skip their own throttling
+def forced():
+    return _synchronous.get() == ALL
+
+
+# Flag data of a provider as served from what was fetched at fetched_at (for stores that keep
+# their own last-known-good data, like the pollen store)
+def mark_stale(provider, key, fetched_at):
+    served = _served.get()
+    with _lock:
+        _stale[(provider, key)] = (fetched_at, time.time())
+        if served is not None:
+            served[provider] = min(served.get(provider, fetched_at), fetched_at)
+    _update_stale_gauge(provider)
+
+
+# The provider answered again for key; changed=True bumps generation() even if it wasn't stale
+def mark_fresh(provider, key, changed=False):
+    global _generation
+    with _lock:
+        was_stale = _stale.pop((provider, key), None) is not None
+        if was_stale or changed:
+            _generation += 1
+    _update_stale_gauge(provider)
+
+
+# Keys of the provider served stale within STALE_EXPIRY, others are dropped (keys like a
+# NASA date range or yesterday's forecast are never asked for again)
+def _update_stale_gauge(provider):
+    now = time.time()
+    with _lock:
+        for expired in [key for key, (_, served_at) in _stale.items() if now - served_at > STALE_EXPIRY]:
+            del _stale[expired]
+        count = sum(1 for stale_provider, _ in _stale if stale_provider == provider)
+    metrics.set_gauge('snapshot_stale', count, provider=provider)
+
+
+# Bumped on every successful background refresh
+def generation():
+    return _generation
@@ -0,0 +1,316 @@
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for every upstream the app talks to, for benchmarks and load tests:
+#
+#   python stub_server.py --port 8765 --latency 0.2 --error-rate 0.05 --stream-delay 0.05
+#   FARMERS_AID_STUB_URL=http://127.0.0.1:8765 streamlit run main.py
+#
+# Responses are replayed from the recorded payloads in stub_fixtures/ with their dates
+# shifted to the request (history for the asked day, forecasts starting today, NASA POWER
+# values for the asked range), so the app sees data that looks current. Latency, error rate
+# and a slow token stream for the chat completions endpoint can be injected.
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_fixtures')
+
+
+def load_fixtures(path=FIXTURES_DIR):
+    fixtures = {}
+    for name in os.listdir(path):
+        if name.endswith('.json'):
+            with open(os.path.join(path, name)) as f:
+                fixtures[name[:-len('.json')]] = json.load(f)
+    return fixtures
+
+
+# Pick a recorded item for a key, the same key always gets the same item
+def _pick(items, key):
+    return items[sum(key.encode('utf-8')) % len(items)]
+
+
+def _localtime(payload):
+    location = payload['location']
+    location['localtime'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+    location['localtime_epoch'] = int(time.time())
+    return payload
+
+
+def weather_current(fixtures, query):
+    return _localtime(copy.deepcopy(fixtures['weatherapi_current']))
+
+
+def weather_history(fixtures, query):
+    payload = _localtime(copy.deepcopy(fixtures['weatherapi_history']))
+    date = query.get('dt', datetime.now().strftime('%Y-%m-%d'))
+    day = copy.deepcopy(_pick(payload['forecast']['forecastday'], date))
+    day['date'] = date
+    day['date_epoch'] = int(datetime.strptime(date, '%Y-%m-%d').timestamp())
+    payload['forecast']['forecastday'] = [day]
+    return payload
+
+
+def weather_forecast(fixtures, query):
+    payload = _localtime(copy.deepcopy(fixtures['weatherapi_forecast']))
+    recorded = payload['forecast']['forecastday']
+    days = max(1, int(query.get('days', len(recorded))))
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    forecast = []
+    for i in range(days):
+        day = copy.deepcopy(recorded[i % len(recorded)])
+        date = today + timedelta(days=i)
+        day['date'] = date.strftime('%Y-%m-%d')
+        day['date_epoch'] = int(date.timestamp())
+        forecast.append(day)
+    payload['forecast']['forecastday'] = forecast
+    return payload
+
+
+def nasa_daily(fixtures, query):
+    payload = copy.deepcopy(fixtures['nasa_daily_point'])
+    recorded = payload['properties']['parameter']
+    start = datetime.strptime(query['start'], '%Y%m%d')
+    end = datetime.strptime(query['end'], '%Y%m%d')
+    parameters = query.get('parameters', 'PRECTOTCORR').split(',')
+    fill_value = payload['header'].get('fill_value', -999.0)
+    # POWER has no values for the last few days yet
+    available_until = datetime.now() - timedelta(days=3)
+
+    result = {}
+    for parameter in parameters:
+        values = list(recorded.get(parameter, {}).values())
+        series = {}
+        day = start
+        while day <= end:
+            if values and day <= available_until:
+                series[day.strftime('%Y%m%d')] = values[day.toordinal() % len(values)]
+            else:
+                series[day.strftime('%Y%m%d')] = fill_value
+            day += timedelta(days=1)
+        result[parameter] = series
+    payload['properties']['parameter'] = result
+    payload['header']['start'] = query['start']
+    payload['header']['end'] = query['end']
+    payload['geometry']['coordinates'][:2] = [float(query.get('longitude', 0)), float(query.get('latitude', 0))]
+    return payload
+
+
+# Rows moved to consecutive hours from first_hour; like Ambee's, rows without a 'time'
+# (latest) only say when they were updated
+def _pollen_hours(rows, first_hour):
+    rows = [copy.deepcopy(row) for row in rows]
+    updated = datetime.utcnow().strftime('%Y-%m-%dT%H:00:00.000Z')
+    for i, row in enumerate(rows):
+        if 'time' in row:
+            row['time'] = first_hour + 3600 * i
+        row['updatedAt'] = updated
+    return rows
+
+
+def ambee_latest(fixtures, query):
+    payload = copy.deepcopy(fixtures['ambee_latest'])
+    payload['data'] = _pollen_hours(payload['data'], int(time.time()) // 3600 * 3600)
+    return payload
+
+
+def ambee_forecast(fixtures, query):
+    payload = copy.deepcopy(fixtures['ambee_forecast'])
+    payload['data'] = _pollen_hours(payload['data'], int(time.time()) // 3600 * 3600 + 3600)
+    return payload
+
+
+# Observed hours between 'from' and 'to' (UTC), replayed from the recorded forecast hours
+def ambee_history(fixtures, query):
+    payload = copy.deepcopy(fixtures['ambee_forecast'])
+    start = int(datetime.strptime(query['from'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp())
+    end = int(datetime.strptime(query['to'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp())
+    recorded = payload['data']
+    first_hour = -(-start // 3600) * 3600
+    hours = range(first_hour, min(end, int(time.time())) + 1, 3600)
+    payload['data'] = _pollen_hours([recorded[(hour // 3600) % len(recorded)] for hour in hours], first_hour)
+    return payload
+
+
+def ipinfo(fixtures, query):
+    return copy.deepcopy(fixtures['ipinfo'])
+
+
+ROUTES = {
+    '/weatherapi/current.json': weather_current,
+    '/weatherapi/history.json': weather_history,
+    '/weatherapi/forecast.json': weather_forecast,
+    '/nasa/temporal/daily/point': nasa_daily,
+    '/ambee/latest/pollen/by-place': ambee_latest,
+    '/ambee/forecast/pollen/by-place': ambee_forecast,
+    '/ambee/history/pollen/by-place': ambee_history,
+    '/ipinfo': ipinfo,
+    '/ipinfo/': ipinfo,
+}
+CHAT_PATH = '/inference/chat/completions'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Set on the server: fixtures, latency, jitter, error_rate, error_status, stream_delay, chunk_size, quiet
+    @property
+    def options(self):
+        return self.server.options
+
+    def log_message(self, format, *args):
+        if not self.options['quiet']:
+            super().log_message(format, *args)
+
+    def _inject(self):
+        delay = self.options['latency'] + random.uniform(0, self.options['jitter'])
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < self.options['error_rate']:
+            self._send_json(self.options['error_status'], {'error': 'injected failure'})
+            return True
+        return False
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        handler = ROUTES.get(url.path)
+        if handler is None:
+            self._send_json(404, {'error': f'no stub for {url.path}'})
+            return
+        if self._inject():
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            payload = handler(self.options['fixtures'], query)
+        except (KeyError, ValueError) as e:
+            self._send_json(400, {'error': f'bad request: {e}'})
+            return
+        self._send_json(200, payload)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if url.path != CHAT_PATH:
+            self._send_json(404, {'error': f'no stub for {url.path}'})
+            return
+        if self._inject():
+            return
+
+        fixture = self.options['fixtures']['inference_chat']
+        content = fixture['content']
+        model = request.get('model') or fixture.get('model', 'stub-model')
+        usage = {'prompt_tokens': sum(len(str(m.get('content', '')).split()) for m in request.get('messages', [])),
+                 'completion_tokens': len(content.split())}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        base = {'id': f'stub-{random.getrandbits(32):08x}', 'created': int(time.time()), 'model': model}
+
+        if not request.get('stream'):
+            self._send_json(200, {**base, 'object': 'chat.completion', 'usage': usage, 'choices': [
+                {'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}]})
+            return
+
+        # Server-sent events, one chunk_size slice of the content per event
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        size = self.options['chunk_size']
+        pieces = [content[i:i + size] for i in range(0, len(content), size)]
+        for i, piece in enumerate(pieces):
+            last = i == len(pieces) - 1
+            chunk = {**base, 'object': 'chat.completion.chunk', 'choices': [
+                {'index': 0, 'delta': {'role': 'assistant', 'content': piece},
+                 'finish_reason': 'stop' if last else None}]}
+            if last:
+                chunk['usage'] = usage
+            self._write_chunk(f'data: {json.dumps(chunk)}\n\n')
+            if self.options['stream_delay']:
+                time.sleep(self.options['stream_delay'])
+        self._write_chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # Clients hanging up (e.g. a completion stream closed early) are not errors here
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def make_server(host='127.0.0.1', port=8765, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503,
+                stream_delay=0.0, chunk_size=16, fixtures_dir=FIXTURES_DIR, quiet=True):
+    server = StubServer((host, port), StubHandler)
+    server.options = {
+        'fixtures': load_fixtures(fixtures_dir),
+        'latency': latency,
+        'jitter': jitter,
+        'error_rate': error_rate,
+        'error_status': error_status,
+        'stream_delay': stream_delay,
+        'chunk_size': chunk_size,
+        'quiet': quiet,
+    }
+    return server
+
+
+# Start a stub server on a background thread (port 0 picks a free port).
+# Returns (server, base_url); call server.shutdown() when done.
+def start_in_background(**options):
+    options.setdefault('port', 0)
+    server = make_server(**options)
+    threading.Thread(target=server.serve_forever, name='stub-server', daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve recorded upstream responses for local testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random latency, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests that fail (0-1)")
+    parser.add_argument('--error-status', type=int, default=503, help="status code of injected failures")
+    parser.add_argument('--stream-delay', type=float, default=0.0, help="seconds between streamed completion chunks")
+    parser.add_argument('--chunk-size', type=int, default=16, help="characters per streamed completion chunk")
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help="directory with the recorded responses")
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                         error_status=args.error_status, stream_delay=args.stream_delay, chunk_size=args.chunk_size,
+                         fixtures_dir=args.fixtures, quiet=not args.verbose)
+    print(f"Stub server on http://{args.host}:{args.port} - set FARMERS_AID_STUB_URL to this address")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
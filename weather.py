@@ -1,20 +1,57 @@
 import requests
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import streamlit as st
+import deadline
+import http_client
+import metrics
+from endpoints import base_url
+from snapshots import SnapshotStore
+from nasa_grid import GridCellCache
+from frames import WEATHER_SCHEMA, FrameBuilder, add_current_weather, add_weather_days, daily_series
 
 # Load environment variables
 
 WEATHER_API_KEY = st.secrets["weather"]  # WeatherAPI key
 NASA_API_KEY = st.secrets["nasa"]  # NASA API key (change if needed)
 
-# Weather API URLs
-REALTIME_URL = 'http://api.weatherapi.com/v1/current.json'
-HISTORY_URL = 'http://api.weatherapi.com/v1/history.json'
-FORECAST_URL = 'http://api.weatherapi.com/v1/forecast.json'
+# Weather API URLs (base URLs are configurable, see endpoints.py)
+REALTIME_URL = f"{base_url('weatherapi')}/current.json"
+HISTORY_URL = f"{base_url('weatherapi')}/history.json"
+FORECAST_URL = f"{base_url('weatherapi')}/forecast.json"
 
 # NASA POWER API URL
-NASA_URL = 'https://power.larc.nasa.gov/api/temporal/daily/point'
+NASA_URL = f"{base_url('nasa')}/temporal/daily/point"
+
+# Max number of API calls in flight at the same time
+MAX_WORKERS = 8
+
+# Last-known-good responses (see snapshots.py). Older than these many seconds they are
+# still served, flagged stale, while a fresh copy is fetched in the background.
+REALTIME_FRESH_FOR = 10 * 60
+FORECAST_FRESH_FOR = 60 * 60
+NASA_FRESH_FOR = 60 * 60
+# A day's history is still filling in until the day is over at the location, then it never
+# changes. The server's clock can't tell when that is, so a day counts as over once it is over
+# everywhere: DAY_OVER_AFTER after it ended in UTC (the last timezone is UTC-12).
+TODAY_HISTORY_TTL = 30 * 60  # seconds
+DAY_OVER_AFTER = timedelta(hours=12)
+
+weather_snapshots = SnapshotStore('weatherapi', max_bytes=20 * 1024 * 1024)
+nasa_snapshots = SnapshotStore('nasa', max_bytes=10 * 1024 * 1024)
+
+# NASA POWER values cached per grid cell, filled by fetch_nasa_snapshot (defined below)
+nasa_cache = GridCellCache(lambda *args: fetch_nasa_snapshot(*args))
+
+# GET a WeatherAPI endpoint, the parsed JSON or None on an error status
+def _get_json(url, params):
+    response = http_client.get('weatherapi', url, params=params)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        return None
 
 # Step 1: Fetch real-time weather data
 def get_real_time_data(location):
@@ -23,11 +60,8 @@ def get_real_time_data(location):
         'q': location,
         'aqi': 'no'
     }
-    response = requests.get(REALTIME_URL, params=params)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return None
+    return weather_snapshots.get(f"current|{_normalize_location(location)}",
+                                 lambda: _get_json(REALTIME_URL, params), fresh_for=REALTIME_FRESH_FOR)
 
 # Step 2: Fetch weather data for a specific date
 def get_weather_data(location, date):
@@ -36,11 +70,20 @@ def get_weather_data(location, date):
         'q': location,
         'dt': date
     }
-    response = requests.get(HISTORY_URL, params=params)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return None
+    return weather_snapshots.get(f"history|{_normalize_location(location)}|{date}",
+                                 lambda: _get_json(HISTORY_URL, params), fresh_for=_history_fresh_for(date))
+
+# How long a history snapshot of date (YYYY-MM-DD) stays fresh: TODAY_HISTORY_TTL while the day
+# may still be running somewhere, afterwards as long as it was fetched after the day was over
+# (so a snapshot of a day in progress is replaced once, then kept)
+def _history_fresh_for(date):
+    over_at = datetime.strptime(date, '%Y-%m-%d').replace(tzinfo=timezone.utc) + timedelta(days=1) + DAY_OVER_AFTER
+    over_for = (datetime.now(timezone.utc) - over_at).total_seconds()
+    return over_for if over_for > 0 else TODAY_HISTORY_TTL
+
+# "  Manama " and "manama" are the same place for the cache
+def _normalize_location(location):
+    return ' '.join(str(location).split()).lower()
 
 # Step 3: Fetch weather forecast data
 def get_forecast_data(location, days):
@@ -50,122 +93,136 @@ def get_forecast_data(location, days):
         'days': days,
         'aqi': 'no'
     }
-    response = requests.get(FORECAST_URL, params=params)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return None
+    return weather_snapshots.get(f"forecast|{_normalize_location(location)}|{days}",
+                                 lambda: _get_json(FORECAST_URL, params), fresh_for=FORECAST_FRESH_FOR)
 
 # Step 4: Fetch historical weather data for the past 7 days
+# Returns daily records (date, response, its 'day' block), see frames.add_weather_days
 def fetch_historical_data(location):
     historical_data = []
     today = datetime.now()
-    for i in range(7):
-        date = (today - timedelta(days=i)).strftime('%Y-%m-%d')
-        data = get_weather_data(location, date)
+    dates = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
+
+    # Fetch all days at once, pool.map keeps the results in the same order as dates
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(dates))) as pool:
+        results = list(pool.map(metrics.bind_context(lambda date: _safe_call(get_weather_data, location, date)),
+                                dates))
+
+    for date, data in zip(dates, results):
         if data:
-            day_data = data['forecast']['forecastday'][0]['day']
-            historical_data.append({
-                'Date': date,
-                'Location': data['location']['name'],
-                'Country': data['location']['country'],
-                'Local Time': data['location']['localtime'],
-                'Avg Temperature (°C)': day_data['avgtemp_c'],
-                'Avg Humidity (%)': day_data['avghumidity'],
-                'Total Precipitation (mm)': day_data['totalprecip_mm'],
-                'Condition': day_data['condition']['text']
-            })
+            historical_data.append((date, data, data['forecast']['forecastday'][0]['day']))
     return historical_data
 
-# Step 5: Fetch forecast weather data for the next 3 days
+# Run a fetch and treat any error as missing data, so one bad call doesn't drop the whole batch
+def _safe_call(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    except (requests.RequestException, ValueError, KeyError):
+        return None
+
+# Step 5: Fetch forecast weather data for the next 3 days, as daily records like fetch_historical_data
 def fetch_forecast_data(location, days=3):
     data = get_forecast_data(location, days)
     forecast_data = []
     if data:
         for day in data['forecast']['forecastday']:
-            forecast_data.append({
-                'Date': day['date'],
-                'Location': data['location']['name'],
-                'Country': data['location']['country'],
-                'Local Time': data['location']['localtime'],
-                'Avg Temperature (°C)': day['day']['avgtemp_c'],
-                'Avg Humidity (%)': day['day']['avghumidity'],
-                'Total Precipitation (mm)': day['day']['totalprecip_mm'],
-                'Condition': day['day']['condition']['text']
-            })
+            forecast_data.append((day['date'], data, day['day']))
     return forecast_data
 
-# Step 6: Fetch precipitation data from NASA API
-def get_precipitation_data(latitude, longitude):
-    current_date = datetime.now()
-    seven_days_ago = current_date - timedelta(days=7)
-    three_days_ahead = current_date + timedelta(days=3)
-
+# Fetch daily NASA POWER values for a point: {parameter: {YYYYMMDD: value}} or None
+def fetch_nasa_daily(latitude, longitude, start, end, parameters):
     params = {
-        'start': seven_days_ago.strftime('%Y%m%d'),
-        'end': three_days_ahead.strftime('%Y%m%d'),
+        'start': start,
+        'end': end,
         'latitude': latitude,
         'longitude': longitude,
         'community': 'AG',
-        'parameters': 'PRECTOTCORR',
+        'parameters': ','.join(parameters),
         'format': 'JSON',
         'header': 'true',
         'api_key': NASA_API_KEY
     }
 
-    response = requests.get(NASA_URL, params=params)
+    response = http_client.get('nasa', NASA_URL, params=params)
     if response.status_code == 200:
         raw_data = response.json()
-        data = raw_data['properties']['parameter']['PRECTOTCORR']
-        df = pd.DataFrame(list(data.items()), columns=['Date', 'Precipitation (mm)'])
-        return df
+        return {parameter: raw_data['properties']['parameter'][parameter] for parameter in parameters}
+    else:
+        return None
+
+# fetch_nasa_daily through the NASA snapshots, for the dashboard (nasa_ingest calls POWER directly)
+def fetch_nasa_snapshot(latitude, longitude, start, end, parameters):
+    key = f"{latitude},{longitude}|{start}|{end}|{','.join(parameters)}"
+    return nasa_snapshots.get(key, lambda: fetch_nasa_daily(latitude, longitude, start, end, parameters),
+                              fresh_for=NASA_FRESH_FOR)
+
+# Step 6: Fetch precipitation data from NASA API, as a Series on a DatetimeIndex
+# (through the grid cell cache, so nearby farms and overlapping date windows share fetches)
+def get_precipitation_data(latitude, longitude):
+    current_date = datetime.now()
+    seven_days_ago = current_date - timedelta(days=7)
+    three_days_ahead = current_date + timedelta(days=3)
+
+    data = nasa_cache.get(latitude, longitude, seven_days_ago.strftime('%Y%m%d'),
+                          three_days_ahead.strftime('%Y%m%d'), ['PRECTOTCORR'])['PRECTOTCORR']
+    if data:
+        return daily_series(data, 'Precipitation (mm)')
     else:
         return None
 
 # Step 7: Main function to fetch all weather data and return a combined DataFrame
 def get_combined_weather_data(location, latitude, longitude):
-    # Fetch real-time, historical, and forecast weather data
-    real_time_weather_data = get_real_time_data(location)
-    historical_weather_data = fetch_historical_data(location)
-    forecast_weather_data = fetch_forecast_data(location, days=3)
-
-    # Create DataFrames for real-time, historical, and forecast data
+    # Fetch real-time, historical, forecast and NASA data at the same time
+    # (bind_context keeps the upstream calls' spans under the caller's span)
+    with metrics.span('weather_fetch', location=location):
+        pool = ThreadPoolExecutor(max_workers=4)
+        try:
+            real_time_future = pool.submit(metrics.bind_context(_safe_call), get_real_time_data, location)
+            historical_future = pool.submit(metrics.bind_context(fetch_historical_data), location)
+            forecast_future = pool.submit(metrics.bind_context(_safe_call), fetch_forecast_data, location, days=3)
+            nasa_future = pool.submit(metrics.bind_context(_safe_call), get_precipitation_data, latitude, longitude)
+
+            # Within the render's budget (see deadline.py); a late call is left to finish in the
+            # background and the frames are built without it
+            real_time = deadline.result(real_time_future, 'weatherapi')
+            historical = deadline.result(historical_future, 'weatherapi', default=[])
+            forecast = deadline.result(forecast_future, 'weatherapi')
+            nasa_precipitation = deadline.result(nasa_future, 'nasa')
+        finally:
+            pool.shutdown(wait=False)
+
+    return build_weather_frames(real_time, historical, forecast or [], nasa_precipitation)
+
+# Build (real_time_df, combined_df) from the fetched pieces: the real-time response (or None),
+# historical and forecast daily records and the NASA precipitation Series (or None)
+def build_weather_frames(real_time_weather_data, historical_weather_data, forecast_weather_data,
+                         nasa_precipitation):
+    with metrics.span('weather_frames') as span:
+        real_time_df, combined_df = _build_weather_frames(real_time_weather_data, historical_weather_data,
+                                                          forecast_weather_data, nasa_precipitation)
+        span.set(rows=len(combined_df))
+    return real_time_df, combined_df
+
+def _build_weather_frames(real_time_weather_data, historical_weather_data, forecast_weather_data,
+                          nasa_precipitation):
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    # One typed frame straight from the responses (see frames.py), the real-time row first
+    combined = FrameBuilder(WEATHER_SCHEMA)
     if real_time_weather_data:
-        current = real_time_weather_data['current']
-        real_time_df = pd.DataFrame([{
-            'Date': datetime.now().strftime('%Y-%m-%d'),
-            'Location': real_time_weather_data['location']['name'],
-            'Country': real_time_weather_data['location']['country'],
-            'Local Time': real_time_weather_data['location']['localtime'],
-            'Avg Temperature (°C)': current['temp_c'],
-            'Avg Humidity (%)': current['humidity'],
-            'Total Precipitation (mm)': current['precip_mm'],
-            'Condition': current['condition']['text']
-        }])
-    else:
-        real_time_df = pd.DataFrame(columns=['Date', 'Location', 'Country', 'Local Time', 'Avg Temperature (°C)',
-                                             'Avg Humidity (%)', 'Total Precipitation (mm)', 'Condition'])
-
-    historical_df = pd.DataFrame(historical_weather_data, columns=['Date', 'Location', 'Country', 'Local Time',
-                                                                   'Avg Temperature (°C)', 'Avg Humidity (%)',
-                                                                   'Total Precipitation (mm)', 'Condition'])
-    forecast_df = pd.DataFrame(forecast_weather_data, columns=['Date', 'Location', 'Country', 'Local Time',
-                                                               'Avg Temperature (°C)', 'Avg Humidity (%)',
-                                                               'Total Precipitation (mm)', 'Condition'])
-
-    # Fetch NASA precipitation data
-    nasa_precipitation_df = get_precipitation_data(latitude, longitude)
-
-    # Merge with NASA precipitation data
-    if nasa_precipitation_df is not None:
-        combined_df = pd.concat([real_time_df, historical_df, forecast_df], ignore_index=True)
-        combined_df = pd.merge(combined_df, nasa_precipitation_df[['Date', 'Precipitation (mm)']], on='Date', how='left')
-        combined_df['Total Precipitation (mm)'] = combined_df['Precipitation (mm)'].combine_first(combined_df['Total Precipitation (mm)'])
-        combined_df.drop(columns=['Precipitation (mm)'], inplace=True)
-    else:
-        combined_df = pd.concat([real_time_df, historical_df, forecast_df], ignore_index=True)
+        add_current_weather(combined, real_time_weather_data, today)
+    add_weather_days(combined, historical_weather_data)
+    add_weather_days(combined, forecast_weather_data)
+    combined_df = combined.build()
+    real_time_df = combined_df.iloc[:1 if real_time_weather_data else 0].copy()
+
+    # Join NASA precipitation on the date, days without a NASA value keep WeatherAPI's
+    precipitation = combined_df['Total Precipitation (mm)'].to_numpy()
+    if nasa_precipitation is not None:
+        nasa_values = nasa_precipitation.reindex(pd.DatetimeIndex(combined_df['Date'])).to_numpy()
+        precipitation = np.where(np.isnan(nasa_values), precipitation, nasa_values)
 
     # Clip precipitation values
-    combined_df['Total Precipitation (mm)'] = combined_df['Total Precipitation (mm)'].clip(lower=0.01, upper=0.99)
+    combined_df['Total Precipitation (mm)'] = np.clip(precipitation, 0.01, 0.99).astype(np.float32)
 
     return real_time_df, combined_df
\ No newline at end of file